@@ -1,7 +1,7 @@
 """
 A frame to handle selecting colours.
 """
-from tkinter import Frame, Radiobutton, IntVar
+from tkinter import Frame, Label, Radiobutton, IntVar
 from tkinter.colorchooser import askcolor
 
 
@@ -80,11 +80,11 @@ class ColourButton(Radiobutton):
     def _selected(self):
         self["text"] = self._selectedText
         if self._selectedMethod is not None:
-            self._selectedMethod(colour)
+            self._selectedMethod(self.getColour())
         return
     
     def unselect(self):
-        self[text] = self._unselectedText
+        self["text"] = self._unselectedText
         return
 
     
@@ -99,6 +99,9 @@ class ColourFrame(Frame):
     Double clicking allows the colour of that button to be changed.
     Selecting a different ColourButton or changing the colour of one
     will be reported back by calling the changed method.
+    Right clicking a button asks for a colour to replace that one 
+    with everywhere, reported back by calling replace(old, new).
+    Under each button can be shown how much of the picture it is.
     """
     
     def __init__(self, 
@@ -106,11 +109,14 @@ class ColourFrame(Frame):
                  seedList, 
                  changed=None,
                  count=32,
-                 defaultColour="white"):
+                 defaultColour="white",
+                 replace=None):
         super().__init__(frame)
         self._selected = IntVar() # index of the colour selected
         self._changed =  changed
+        self._replace = replace
         self._colours = [] # list ColourButtons
+        self._usage = [] # list of Labels under them
         for i in range(count):
             if i < len(seedList):
                 colour = seedList[i]
@@ -118,21 +124,43 @@ class ColourFrame(Frame):
                 colour = defaultColour
             b = ColourButton(self, 
                              colour, 
-                             self._wasSelected, 
-                             value=i)
+                             self._selected, 
+                             value=i,
+                             selected=self._wasSelected)
             b.grid(column=i, row=0)
             b.bind("<Double-Button-1>", self.changeColour)
+            b.bind("<Button-3>", self.replaceColour)
             self._colours.append(b)
+            usage = Label(self, text="", font=("", 7))
+            usage.grid(column=i, row=1)
+            self._usage.append(usage)
         self._lastIndex = 0 # index of the colour we last selected
         self._selected.set(self._lastIndex)  # initialise
+        self._wasSelected()
         return
 
-    def _wasSelected(self):
+    def _wasSelected(self, colour=None):
+        if len(self._colours) <= self._selected.get():
+            return  # still making them
         selected = self._getColourButton() 
-        for colourButton  in self_colours:
+        for colourButton  in self._colours:
             if colourButton != selected:
                 colourButton.unselect()
-        self.select(selected) 
+        self.selected(selected) 
+        return
+
+    def replaceColour(self, event):
+        """
+        Respond to a right click on a colour radio button with a
+        tkinter askcolour dialog box to select a colour to replace
+        that one with, everywhere.
+        """
+        radioButton = event.widget
+        currentColour = radioButton.getColour()
+        hexstr = askcolor(currentColour)[1] # get rbg hex string for new colour
+        if hexstr is not None and self._replace is not None:
+            radioButton.setColour(hexstr)
+            self._replace(currentColour, hexstr)
         return
     
     def changeColour(self, event=None):
@@ -164,6 +192,42 @@ class ColourFrame(Frame):
         colourButton = self._getColourButton()
         return colourButton.getColour()
 
+    def getColours(self):
+        """
+        Get the colours of all the buttons.
+        """
+        return [colourButton.getColour() for colourButton in self._colours]
+
+    def select(self, colour):
+        """
+        Select the first button of colour, if there is one.
+        """
+        for index, colourButton in enumerate(self._colours):
+            if colourButton.getColour() == colour:
+                self._selected.set(index)
+                colourButton._selected()
+                return True
+        return False
+
+    def showUsage(self, usage):
+        """
+        Show under each button the percentage of the picture that
+        is its colour, from usage (a dict of colour to fraction).
+        """
+        for colourButton, label in zip(self._colours, self._usage):
+            # buttons can have named colours, usage is by #rrggbb
+            red, green, blue = self.winfo_rgb(colourButton.getColour())
+            colour = "#%02x%02x%02x" % (red >> 8, green >> 8, blue >> 8)
+            fraction = usage.get(colour, 0)
+            if fraction >= 0.01:
+                text = "%d%%" % round(fraction * 100)
+            elif fraction > 0:
+                text = "<1%"
+            else:
+                text = ""
+            label["text"] = text
+        return
+
     def setColour(self, colour):
         colourButton = self._getColourButton()
         colourButton.setColour(colour)
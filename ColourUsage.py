@@ -0,0 +1,92 @@
+"""
+How much of a palette picture is each colour, kept up to date as it is edited.
+"""
+from PadImage import hexColour, paletteColours
+
+
+class ColourUsage:
+    """
+    The number of pixels of each palette index of a picture.
+
+    Started from the histogram of the whole picture (which loading
+    works out anyway), then each edit only counts the box it changed:
+    call changing() with the box before the edit and changed() with
+    the same box after it (or counted() with a copy of the box from
+    before and one from after), so the picture is never counted again.
+    """
+
+    def __init__(self):
+        self.image = None
+        self.counts = []  # pixels of each palette index
+        self.total = 0  # pixels in the picture
+        return
+
+    def start(self, image, counts=None):
+        """
+        Start counting image, given its histogram if already known.
+        """
+        self.image = image
+        self.counts = list(counts if counts is not None else image.histogram())
+        self.total = image.width * image.height
+        return
+
+    def _add(self, part, sign):
+        for index, count in enumerate(part.histogram()):
+            if count:
+                if index >= len(self.counts):
+                    self.counts.extend([0] * (index + 1 - len(self.counts)))
+                self.counts[index] += sign * count
+        return
+
+    def changing(self, box):
+        """
+        The picture is about to change in box.
+        """
+        if self.image is not None:
+            self._add(self.image.crop(box), -1)
+        return
+
+    def changed(self, box):
+        """
+        The picture has changed in box.
+        """
+        if self.image is not None:
+            self._add(self.image.crop(box), 1)
+        return
+
+    def counted(self, before, after):
+        """
+        A part of the picture that was before is now after.
+        """
+        if self.image is not None:
+            self._add(before, -1)
+            self._add(after, 1)
+        return
+
+    def usage(self):
+        """
+        Get a dict of #rrggbb colour to the fraction
+        of the picture that is that colour.
+        """
+        usage = {}
+        if not self.total:
+            return usage
+        for index, rgb in enumerate(paletteColours(self.image)):
+            if index < len(self.counts) and self.counts[index]:
+                colour = hexColour(rgb)
+                usage[colour] = (usage.get(colour, 0)
+                                 + self.counts[index] / self.total)
+        return usage
+
+    def ordered(self, colours, enough=None):
+        """
+        Get colours (#rrggbb strings) most used first, without any
+        used by no more than enough of the picture (a fraction) if given.
+        """
+        usage = self.usage()
+        kept = []
+        for colour in colours:
+            if colour not in kept and (enough is None
+                                       or usage.get(colour, 0) > enough):
+                kept.append(colour)
+        return sorted(kept, key=lambda colour: -usage.get(colour, 0))
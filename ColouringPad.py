@@ -2,24 +2,33 @@
 
 '''
 Add on ideas - width / height and both options for zoom
-Rotate 90 option to fit more on screen (portrait on landscape systems)
 Current selected colour button
 Colour dialog - Select from known names of colours, dropper for grabbing existing colour
-Sorting known colours in some order
-Removal of low use colours with similar used ones - eg nearly black to black ...
 '''
 
 import gc
 import math
 import os
-from tkinter import Frame, Label, Canvas, Menu, Button, Radiobutton, Scale, Toplevel
+from tkinter import Frame, Label, Canvas, Menu, Button, Radiobutton, Scale, Toplevel, Text
 from tkinter import HORIZONTAL, VERTICAL, E, W, N, S
-from tkinter import Tk, ttk, IntVar, filedialog, messagebox
+from tkinter import Tk, ttk, IntVar, BooleanVar, filedialog, messagebox
 from tkinter.colorchooser import askcolor
 
-from PIL import Image, ImageTk, ImageDraw, ImageColor
-
 from ColourFrame import ColourFrame
+from ColourUsage import ColourUsage
+from FillEngine import region, gapRegion, lineDistance, updateDistance
+from PadGallery import PadGallery
+from PadImage import analyseImage, previewImage, usedColours, pixelColour, colourIndex
+from PadImage import saveImage, fixDelta, fixBox, fixBlob
+from PadImage import brushLine, lineGaps, replaceColour, previewCopy
+from PadJournal import PadJournal
+from PadMemory import PadMemory
+from PadStats import stats
+from PadView import PadView
+from PadWorker import PadWorker
+from RegionMap import RegionMap
+from UndoHistory import UndoHistory
+from ZoomCache import ZoomCache
 
 
 def PadError(errorText, title="Colouring Pad - Oops!"):
@@ -35,32 +44,71 @@ def PadConfirm(questionText, title="Colouring Pad"):
     return messagebox.askyesno(title=title, message=questionText)
 
 
-def PadWait(parent, waitText, title="Please Wait"):
-    class Wait:
-        '''
-        
-        '''
-    
-        def __init__(self, parent, text, title):
-            # print("Wait init", title, text)
-            self.parent = parent
-            top = self.top = Toplevel(parent)
-            self.top.title(title)
-            # self.top.overrideredirect(True)
-            self.top.focus_set()
-            self.top.grab_set()
-            self.label = Label(top, text=text)
-            self.label.grid(column=1, row=0)
-            self.top.geometry("+%d+%d" % (parent.winfo_rootx() + 50, parent.winfo_rooty() + 50))
-            return
-    
-        def quit(self):
-            # print("Wait quit")
-            self.parent.focus_set()
-            self.top.destroy()
-            return
-          
-    return Wait(parent, waitText, title)
+class PadStatsDialog:
+    '''
+    Shows how long each operation has been taking, and how much
+    memory each part holds, and lets a profile be captured and 
+    everything exported.
+    '''
+
+    def __init__(self, parent, closed=None, memory=None):
+        self.closed = closed
+        self.memory = memory
+        top = self.top = Toplevel(parent)
+        top.title("Colouring Pad - Info")
+        top.protocol("WM_DELETE_WINDOW", self.quit)
+        self.text = Text(top, width=64, height=24, wrap="none")
+        self.text.grid(column=0, row=0, columnspan=4, sticky=(N, W, E, S))
+        self.profileButton = Button(top, text="Start profile", 
+                                    command=self.profile)
+        self.profileButton.grid(column=0, row=1, pady=5, padx=5)
+        Button(top, text="Refresh", command=self.show).grid(
+            column=1, row=1, pady=5, padx=5)
+        Button(top, text="Export...", command=self.export).grid(
+            column=2, row=1, pady=5, padx=5)
+        Button(top, text="Close", command=self.quit).grid(
+            column=3, row=1, pady=5, padx=5)
+        top.grid_columnconfigure(0, weight=1)
+        top.grid_rowconfigure(0, weight=1)
+        self.show()
+        return
+
+    def show(self):
+        text = stats.report()
+        if self.memory:
+            text += "\n\n" + self.memory.report()
+        if stats.profile and not stats.profiling():
+            text += "\n\nLast profile:\n" + stats.profile
+        self.text.delete("1.0", "end")
+        self.text.insert("1.0", text)
+        return
+
+    def profile(self):
+        if stats.profiling():
+            stats.stopProfile()
+            self.profileButton.config(text="Start profile")
+        else:
+            stats.startProfile()
+            self.profileButton.config(text="Stop profile")
+        self.show()
+        return
+
+    def export(self):
+        filename = filedialog.asksaveasfilename(
+            parent=self.top, title="Export timings",
+            filetypes=(("JSON files", "*.json"), ("all files", "*.*")), 
+            defaultextension=".json")
+        if filename:
+            stats.export(filename)
+        return
+
+    def quit(self):
+        if stats.profiling():
+            stats.stopProfile()
+        self.top.destroy()
+        if self.closed:
+            self.closed()
+        return
 
 
 class ColouringPad(Frame):
@@ -72,8 +120,8 @@ class ColouringPad(Frame):
         self.master = master
         self.master.title("Colouring Pad")
         self.saved = True
-        self.undoSaved = False
-        self.undoList = []  # use: self.undoList.insert(0, image) to add, and self.undoList.pop([0]) to remove
+        self.changes = 0  # edits ever made, to tell if saved since
+        self.history = UndoHistory(budget=64 * 1024 * 1024)  # bytes
         self.dragging = False
         # get the name of our directory to access data
         self.baseDir = os.path.dirname(__file__)  # includes this module name (Editor)
@@ -89,15 +137,58 @@ class ColouringPad(Frame):
         self.mode = IntVar()
         self.mode.set(1)
         self.lastMode = self.mode.get()
+        self.tolerance = IntVar()  # how different a colour fill treats as same
+        self.tolerance.set(0)
         self.zoom = 100
+        self.zoomCache = ZoomCache(budget=256 * 1024 * 1024)  # bytes
+        self.regions = RegionMap()
+        self.usage = ColourUsage()  # how much of the picture each colour is
+        self.distance = (0, None)  # (cap, lineDistance()) for gap fills
+        self.memory = PadMemory(budget=1024 * 1024 * 1024)  # bytes
+        self.memoryBudget = IntVar()  # MB the memory is kept within
+        self.memoryBudget.set(1024)
+        # coldest first, as those are the first asked to spill
+        self.memory.register("undo", self.history.used, self.history.spill)
+        self.memory.register("zoom levels", self.zoomCache.used,
+                             self.zoomCache.spill)
+        self.memory.register("view", lambda: self.view.used(),
+                             lambda wanted: self.view.spill(wanted))
+        self.memory.register("picture", self.pictureUsed)
+        self.memory.register("regions", self.regions.used)
+        self.memory.register("line distance", self.distanceUsed)
+        # slow work is done by the worker, anything else waits its turn
+        self.worker = PadWorker(master, busy=self.busy, idle=self.runTasks)
+        self.tasks = []  # (key, function) to run when worker is free
+        self.saver = PadWorker(master)  # saves don't hold up colouring
+        self.compression = IntVar()  # PNG compression level
+        self.compression.set(6)
+        self.indexed = BooleanVar()  # save PNGs with a palette
+        self.indexed.set(True)
+        self.previewing = False  # showing a rough copy while loading
+        self.maxPixels = IntVar()  # largest picture to work on (0 for any)
+        self.maxPixels.set(0)
+        self.mergeDistance = IntVar()  # how close rare colours merge at load
+        self.mergeDistance.set(20)
+        self.gap = IntVar()  # widest gap in a line adjust closes
+        self.gap.set(3)
+        self.rotated = BooleanVar()  # shown a quarter turn clockwise
+        self.rotated.set(False)
         self.image = None  # Image.new("RGB", (3000, 3000), color="white")
-        self.wait = None
+        self.statsDialog = None
+        self.galleryDialog = None
+        self.journal = None  # operations done since loading, for a crash
+        self.compacting = False  # a checkpoint of the journal is on the way
+        self.settings = None  # how the picture was loaded
         self.oldColour = None
         self.granularity = 2 / 1000  # how course line fixing should be
+        self.stroke = None  # the brush stroke being painted
+        self.strokeFrame = 16  # ms between drawing bits of a stroke
+        self.strokeBlock = 64  # pixels each way kept for a stroke's undo
         self.oldValue = -1
         self.ok = True
         self.col, self.row = 1, 3  # for canvas
         self.canvas = None
+        self.colourStrip = None
         self.create_widgets()
         self.filename = os.path.join(self.lastdir, "default.png")
         self.frame.update_idletasks()
@@ -152,35 +243,111 @@ class ColouringPad(Frame):
         menubar.add_cascade(menu=menu_edit, label='Edit', underline=0)
         menu_file.add_command(label='Load...', command=self.load, 
                               underline=0, accelerator="ctrl+L")
+        menu_file.add_command(label='Gallery...', command=self.gallery, 
+                              underline=0, accelerator="ctrl+B")
         menu_file.add_command(label='Save...', command=self.save, 
                               underline=0, accelerator="ctrl+S")
+        menu_size = Menu(menu_file)
+        menu_file.add_cascade(menu=menu_size, label='Working size',
+                              underline=0)
+        for label, value in (("Full", 0), ("4 mega pixels", 4000000),
+                             ("8 mega pixels", 8000000),
+                             ("16 mega pixels", 16000000)):
+            menu_size.add_radiobutton(label=label, value=value,
+                                      variable=self.maxPixels)
+        menu_memory = Menu(menu_file)
+        menu_file.add_cascade(menu=menu_memory, label='Memory', underline=0)
+        for label, value in (("256 MB", 256), ("512 MB", 512),
+                             ("1 GB", 1024), ("2 GB", 2048)):
+            menu_memory.add_radiobutton(label=label, value=value,
+                                        variable=self.memoryBudget,
+                                        command=self.setMemory)
+        menu_merge = Menu(menu_file)
+        menu_file.add_cascade(menu=menu_merge, label='Merge colours',
+                              underline=0)
+        for label, value in (("None", 0), ("Slight", 10), ("Some", 20),
+                             ("Lots", 40)):
+            menu_merge.add_radiobutton(label=label, value=value,
+                                       variable=self.mergeDistance)
+        menu_gap = Menu(menu_file)
+        menu_file.add_cascade(menu=menu_gap, label='Gap size', underline=0)
+        for label, value in (("2 pixels", 2), ("3 pixels", 3), 
+                             ("5 pixels", 5), ("8 pixels", 8)):
+            menu_gap.add_radiobutton(label=label, value=value,
+                                     variable=self.gap)
         menu_file.add_command(label='Adjust', command=self.adjust, 
                               underline=0, accelerator="ctrl+a")
+        menu_file.add_command(label='Adjust visible part', 
+                              command=lambda: self.adjust(visible=True), 
+                              underline=7, accelerator="ctrl+shift+A")
+        menu_saving = Menu(menu_file)
+        menu_file.add_cascade(menu=menu_saving, label='Save as', underline=5)
+        for label, value in (("Quick", 1), ("Normal", 6), ("Smallest", 9)):
+            menu_saving.add_radiobutton(label=label, value=value,
+                                        variable=self.compression)
+        menu_saving.add_separator()
+        menu_saving.add_checkbutton(label="Palette PNG", 
+                                    variable=self.indexed)
         menu_file.add_command(label='Exit', command=self.exit, 
                               underline=1, accelerator="ctrl+X")
         menu_edit.add_command(label='Undo', command=self.undo, 
                               accelerator="ctrl+Z")
+        menu_edit.add_command(label='Redo', command=self.redo, 
+                              accelerator="ctrl+Y")
+        menu_edit.add_command(label='Replace colour...', 
+                              command=self.replaceChosen, 
+                              underline=0, accelerator="ctrl+E")
         menu_edit.add_command(label='Change colour', command=self.colourChange, 
                               underline=7, accelerator="ctrl+C")
         menu_edit.add_command(label='Mode - Fill', command=self.setFill, 
                               underline=7, accelerator="ctrl+F")
         menu_edit.add_command(label='Mode - Fix', command=self.setFix, 
                               underline=8, accelerator="ctrl+I")
+        menu_edit.add_command(label='Mode - Gap fill', command=self.setGapFill, 
+                              underline=7, accelerator="ctrl+G")
+        menu_edit.add_command(label='Mode - Brush', command=self.setBrush, 
+                              underline=8, accelerator="ctrl+R")
+        menu_tolerance = Menu(menu_edit)
+        menu_edit.add_cascade(menu=menu_tolerance, label='Fill tolerance',
+                              underline=5)
+        for label, value in (("Exact", 0), ("Low", 24), ("Medium", 48),
+                             ("High", 96)):
+            menu_tolerance.add_radiobutton(label=label, value=value,
+                                           variable=self.tolerance)
+        menu_edit.add_command(label='Sort colours', command=self.sortColours,
+                              underline=0)
+        menu_edit.add_command(label='Prune colours', 
+                              command=lambda: self.sortColours(prune=True),
+                              underline=0)
+        menu_edit.add_checkbutton(label='Rotate 90', variable=self.rotated,
+                                  command=self.rotate, underline=0,
+                                  accelerator="ctrl+T")
+        menu_edit.add_command(label='Cancel', command=self.cancel, 
+                              underline=0, accelerator="Esc")
         menu_edit.add_command(label='Info', command=self.info, 
                               underline=4, accelerator="ctrl+O")
         # Add keyboard short cuts
         frame.bind("<Control-l>", lambda event: self.load())
+        frame.bind("<Control-b>", lambda event: self.gallery())
         frame.bind("<Control-s>", lambda event: self.save())
         frame.bind("<Control-a>", lambda event: self.adjust())
+        frame.bind("<Control-A>", lambda event: self.adjust(visible=True))
         frame.bind("<Control-x>", lambda event: self.exit())
         frame.bind("<Control-c>", lambda event: self.colour(None))
+        frame.bind("<Control-e>", lambda event: self.replaceChosen())
         frame.bind("<Control-f>", lambda event: self.setFill())
         frame.bind("<Control-i>", lambda event: self.setFix())
+        frame.bind("<Control-g>", lambda event: self.setGapFill())
+        frame.bind("<Control-r>", lambda event: self.setBrush())
         frame.bind("<Control-z>", lambda event: self.undo())
+        frame.bind("<Control-y>", lambda event: self.redo())
         frame.bind("<Control-o>", lambda event: self.info())
+        frame.bind("<Control-t>", lambda event: self.toggleRotate())
+        frame.bind("<Escape>", lambda event: self.cancel())
         return
 
     def pictureCanvas(self, width, height):
+        # made the once, the view then just changes its scrollregion
         # print("pictureCanvas")
         frame = self.frame
         col, row = self.col, self.row
@@ -189,15 +356,15 @@ class ColouringPad(Frame):
         v = ttk.Scrollbar(frame, orient=VERTICAL)
         v.grid(column=col + 1, row=row, sticky=(N, S))
         self.canvas = Canvas(frame, scrollregion=(0, 0, width, height),
-                               yscrollcommand=v.set, xscrollcommand=h.set,
                                borderwidth=2, relief="groove")  
         # alternatives are: raised, sunken, flat, ridge, solid, and groove 
         # and (width=3000, height=3000,)
         self.canvas.grid(column=col, row=row, sticky=(N, W, E, S))
-        h['command'] = self.canvas.xview
-        v['command'] = self.canvas.yview
+        # the view hooks up the scrollbars and only renders what is seen
+        self.view = PadView(self.canvas, h, v, self.zoomCache)
         self.canvas.bind("<ButtonPress-1>", self.pressed)
         # self.canvas.bind("<Motion>", self.motion)
+        self.canvas.bind("<B1-Motion>", self.motion)
         self.canvas.bind("<ButtonRelease-1>", self.released)
         # print("pictureCanvas-ret")
         return
@@ -227,6 +394,14 @@ class ColouringPad(Frame):
                                      text="Fix", value=0)
         self.buttonDropper = Radiobutton(self.buttonStrip, variable=self.mode, 
                                          text="Dropper", value=2)
+        self.buttonGapFill = Radiobutton(self.buttonStrip, variable=self.mode, 
+                                         text="Gap fill", value=3)
+        self.buttonBrush = Radiobutton(self.buttonStrip, variable=self.mode, 
+                                       text="Brush", value=4)
+        self.progress = ttk.Progressbar(self.buttonStrip, mode="indeterminate",
+                                        length=80)
+        self.buttonCancel = Button(self.buttonStrip, text="Cancel", 
+                                   state="disabled", command=self.cancel)
         # arrange
         self.buttonLoad.grid(column=1, row=0, pady=5, padx=5)
         self.buttonSave.grid(column=2, row=0, pady=5, padx=5)
@@ -239,27 +414,59 @@ class ColouringPad(Frame):
         self.buttonFill.grid(column=12, row=0)
         self.buttonFix.grid(column=13, row=0)
         self.buttonDropper.grid(column=14, row=0)
+        self.buttonGapFill.grid(column=15, row=0)
+        self.buttonBrush.grid(column=16, row=0)
+        # and how busy we are after that
+        self.progress.grid(column=18, row=0, padx=5)
+        self.buttonCancel.grid(column=19, row=0, pady=5, padx=5)
         # print("AddButtons - call set zoom")
         self.setZoom(100)
         return
 
     def addColours(self):
         buttonCol, buttonWidth, buttonRow = 1, 2, self.colourRow
+        if self.colourStrip is not None:
+            self.colourStrip.destroy()  # rather than pile them up
+            self.colourStrip = None
         self.colourStrip = ColourFrame(self.frame,
                                        self.used,
-                                       self.colourChanged) 
+                                       self.colourChanged,
+                                       replace=self.replace) 
         # the rest are defaults:       ,
         #                              count=32,
         #                              defaultColour="white")
         self.colourStrip.grid(column=buttonCol, row=buttonRow, 
                               columnspan=buttonWidth, sticky=(N, E, W, S))
         self.chosen = self.colourStrip.getColour()
+        self.showUsage()
         return
 
     def colourChanged(self, colour):
         # called when the colour is changed
-        self.undoSaved = False
         self.chosen = colour
+        if self.colourStrip is not None:
+            self.showUsage()
+        return
+
+    def showUsage(self):
+        self.colourStrip.showUsage(self.usage.usage())
+        return
+
+    def sortColours(self, prune=False):
+        # most used colours first, dropping those hardly used if pruning
+        if not self.image:
+            return
+        chosen = self.chosen
+        colours = self.colourStrip.getColours()
+        used = self.usage.ordered(colours, 1 / 100 if prune else None)
+        for colour in self.defaultColours:
+            if len(used) >= len(self.defaultColours):
+                break
+            if colour not in used:
+                used.append(colour)
+        self.used = used
+        self.addColours()
+        self.colourStrip.select(chosen)
         return
 
     def zoomed(self, event):
@@ -307,20 +514,84 @@ class ColouringPad(Frame):
 
     def setFill(self):
         self.mode.set(1)
-        self.undoSaved = False
         return
 
     def setFix(self):
         self.mode.set(0)
-        self.undoSaved = False
+        return
+
+    def setGapFill(self):
+        self.mode.set(3)
+        return
+
+    def setBrush(self):
+        self.mode.set(4)
+        return
+
+    def toggleRotate(self):
+        self.rotated.set(not self.rotated.get())
+        self.rotate()
+        return
+
+    def rotate(self):
+        # only the view turns, the picture stays as it is
+        if self.stroke:
+            self.rotated.set(self.view.rotated)
+            self.bell()  # not part way through a stroke
+            return
+        self.view.rotated = self.rotated.get()
+        if self.previewing:
+            preview = self.view.image
+            self.view.setImage(preview, self.fitZoom(preview.size) / 100)
+        elif self.image:
+            self.setZoom(self.fitZoom(self.image.size))
+            self.resize()
         return
 
     def colourChange(self):
         self.colourStrip.changeColour()
         return
 
+    def replaceChosen(self):
+        # replace the chosen colour with another everywhere
+        old = self.chosen
+        new = askcolor(old)[1]
+        if new is not None:
+            self.colourStrip.setColour(new)
+            self.replace(old, new)
+        return
+
+    def replace(self, old, new):
+        self.later(lambda: self._replace(old, new))
+        return
+
+    def _replace(self, old, new):
+        if not self.image:
+            return
+        palette = self.image.getpalette()
+        with stats.timed("replace colour"):
+            box, before = replaceColour(self.image, old, new)
+        if box is None:
+            return  # not used
+        if before is not None:
+            self.regions.changed(self.image, box)
+        self.record(box, before, palette, ("replace", old, new))
+        return
+
+    def recoloured(self):
+        # only the palette changed, so just show it with its new colours
+        with stats.timed("redisplay"):
+            self.zoomCache.paletteChanged()
+            self.view.refresh()
+        self.distance = (0, None)  # lines may have changed colour
+        return
+
     def exit(self):
-        if not self.saved:
+        if self.saver.busy():
+            if PadConfirm("Still saving the picture! \n"
+                          "Do you want to quit before it's finished?"):
+                self._quit()
+        elif not self.saved:
             response = PadConfirm("Unsaved picture! \n" 
                                   "Do you want to quit without saving it?")
             if response:
@@ -330,40 +601,38 @@ class ColouringPad(Frame):
         return
 
     def _quit(self):
+        if self.journal:
+            self.journal.discard()  # saved or not wanted
+        self.history.clear()  # and anything spilled to disk
+        self.zoomCache.setImage(None)
         self.master.destroy()
         return
 
     def info(self):
-        if self.wait:
-            self.wait.quit()
-            self.wait = None
+        if self.statsDialog:
+            self.statsDialog.top.lift()
         else:
-            self.wait = PadWait(self.canvas, "Please wait")
-        # print("image", self.image.size)
-        widget = self.canvas
-        # print("Canvas: width", widget.winfo_width(),
-        #       "rootx", widget.winfo_rootx(),
-        #       "xview", widget.xview(), 
-        #       (self.image.width*widget.xview()[0], 
-        #       self.image.width*widget.xview()[1]))
-        # print("1.0 - widget.xview()[1]", 
-        #       1.0 - widget.xview()[1], 
-        #       ((1.0 - widget.xview()[1]) > 0.01))
-        while ((1.0 - widget.xview()[1]) > 0.01):
-            s = input('--> ')
-            if len(s) > 0:
-                break
-            # print("about to scroll", "1 p")
-            widget.xview_scroll(1, "p")
-            self.frame.update_idletasks()
-            # print("Canvas: width", widget.winfo_width(),
-            #       "rootx", widget.winfo_rootx(),
-            #       "xview", widget.xview(), 
-            #       (self.image.width*widget.xview()[0],  
-            #       self.image.width*widget.xview()[1]))
-            # print("1.0 - widget.xview()[1]",  
-            #       1.0 - widget.xview()[1],  
-            #       ((1.0 - widget.xview()[1]) > 0.01))
+            self.statsDialog = PadStatsDialog(self.frame, self._infoClosed,
+                                              self.memory)
+        return
+
+    def setMemory(self):
+        self.memory.budget = self.memoryBudget.get() * 1024 * 1024
+        self.memory.check()
+        return
+
+    def pictureUsed(self):
+        image = self.image
+        if not image:
+            return 0
+        return image.width * image.height * len(image.getbands())
+
+    def distanceUsed(self):
+        distance = self.distance[1]
+        return distance.width * distance.height if distance else 0
+
+    def _infoClosed(self):
+        self.statsDialog = None
         return
 
     def load(self):
@@ -376,6 +645,27 @@ class ColouringPad(Frame):
             self._load()
         return
 
+    def gallery(self):
+        if not self.saved and not PadConfirm(
+                "Unsaved picture! \n"
+                "Do you want to load another without saving it?"):
+            return
+        if self.galleryDialog:
+            self.galleryDialog.top.lift()
+        else:
+            self.galleryDialog = PadGallery(self.frame, self.lastdir, 
+                                            self.picked, self._galleryClosed)
+        return
+
+    def picked(self, filename):
+        self.filename = filename
+        self.loadFile()
+        return
+
+    def _galleryClosed(self):
+        self.galleryDialog = None
+        return
+
     def _load(self):
         self.filename = filedialog.askopenfilename(initialdir=self.lastdir, 
                                                    title="Load picture",
@@ -393,68 +683,246 @@ class ColouringPad(Frame):
         # print("loadFile")
         if self.filename != "":
             self.lastdir = os.path.dirname(self.filename)
-            image = Image.open(self.filename)
-            # print("Loaded", "size", image.size, "mode", image.mode)
-            enough = image.width * image.height / 100  # 1% of image ...
-            image = image.convert()  # to RBG
-            # print("Converted", "size", image.size, "mode", image.mode)
-            image = image.quantize(colors=32)  # reduce to max 32 colours
-            # print("Quantized", "size", image.size, "mode", image.mode)
-            image = image.convert()  # to RBG (again) so can do the colour fill
-            # print("Converted", "size", image.size, "mode", image.mode)
-            # palette = image.getpalette()
-            colours = image.getcolors()
-            count = 0
-            used = []
-            if colours:
-                for i in range(len(colours)):
-                    if colours[i][0] > enough:
-                        # make minimum list of colours in #rrggbb format
-                        used.append("#%02x%02x%02x" % colours[i][1][0:3])  
-                        count += 1
-            # print("count", count)
-            if count < len(self.defaultColours):
-                used.extend(self.defaultColours)
-            used = sorted(used)
-            self.used = used
-            self.setImage(image)
+            filename = self.filename
+            size = self.windowSize()
+            maxPixels = self.maxPixels.get()
+            # a rough copy to look at first, then the real thing
+            preview = size[0] > 1 and size[1] > 1
+            if preview:
+                self.later(lambda: self.worker.submit(
+                    lambda job: previewImage(filename, size),
+                    done=self.previewed, failed=lambda error: None,  # never mind
+                    name="previewing"))
+            settings = {"maxPixels": maxPixels,
+                        "distance": self.mergeDistance.get()}
+            journal = PadJournal(filename)
+            # the journal of the picture open now is ours, not left over
+            ours = self.journal is not None and (
+                os.path.abspath(self.journal.filename) == os.path.abspath(filename))
+            if not ours and journal.exists() and PadConfirm(
+                    "This picture wasn't finished with last time.\n"
+                    "Do you want to carry on where you left off?"):
+
+                def load(job):
+                    image, settings = journal.replay()
+                    return image, image.histogram(), settings, True
+            else:
+
+                def load(job):
+
+                    def decoded(rgb):  # a PNG is previewed from this
+                        if preview:
+                            job.report(previewCopy(rgb, size))
+
+                    # max 32 colours, nearly black to black and so on
+                    image, counts = analyseImage(filename, maxPixels,
+                                                 settings["distance"], decoded)
+                    journal.start(settings)
+                    return image, counts, settings, False
+
+            self.later(lambda: self.worker.submit(
+                load, done=lambda result: self.loaded(journal, *result), 
+                failed=self.failed, name="loading", progress=self.previewed))
         # print("loadFile-ret")
         return
 
+    def previewed(self, preview):
+        # show the rough copy, but don't colour it
+        if preview is None or self.previewing:
+            return  # small enough not to need one, or already got one
+        self.previewing = True
+        self.view.setImage(preview, self.fitZoom(preview.size) / 100)
+        return
+
+    def loaded(self, journal, image, counts, settings, replayed):
+        if self.journal and self.journal.filename != journal.filename:
+            self.journal.discard()  # that picture's been given up on
+        elif self.journal:
+            self.journal.close()  # the same picture, started afresh
+        self.journal, self.settings = journal, settings
+        self.saved = not replayed
+        # print("Loaded", "size", image.size, "mode", image.mode)
+        enough = image.width * image.height / 100  # 1% of image ...
+        # make minimum list of colours in #rrggbb format
+        used = usedColours(image, enough, counts)
+        self.usage.start(image, counts)
+        used = self.usage.ordered(used)  # most used first
+        # print("count", len(used))
+        if len(used) < len(self.defaultColours):
+            used.extend(self.defaultColours)
+        self.used = used
+        self.setImage(image)
+        return
+
+    def unpreview(self):
+        # stop showing a rough copy, back to what we had
+        if self.previewing:
+            self.previewing = False
+            self.view.setImage(self.image, self.zoom / 100)
+        return
+
+    def failed(self, error):
+        self.unpreview()
+        PadError("Sorry, that didn't work!\n" + str(error))
+        return
+
+    def later(self, function, key=None):
+        # run function once the worker (and anything before it) is done
+        if key is not None and self.tasks and self.tasks[-1][0] == key:
+            return  # same again, so only do it the once
+        self.tasks.append((key, function))
+        self.runTasks()
+        return
+
+    def runTasks(self):
+        while self.tasks and not self.worker.busy() and not self.stroke:
+            key, function = self.tasks.pop(0)
+            function()
+        return
+
+    def busy(self, busy):
+        # show whether the worker is busy
+        if busy:
+            self.progress.start()
+            self.buttonCancel.config(state="normal")
+        else:
+            self.progress.stop()
+            self.buttonCancel.config(state="disabled")
+        if self.canvas:
+            self.canvas.config(cursor="watch" if busy else "")
+        return
+
+    def cancel(self):
+        # give up on whatever is being done and anything waiting
+        self.tasks = []
+        self.compacting = False
+        self.worker.cancel()
+        self.zoomCache.cancel()
+        self.unpreview()
+        return
+
     def undo(self):
-        if len(self.undoList) > 0:  # we have an undo available
-            image = self.undoList.pop()
-            self.setImage(image)
+        self.later(self._undo)
         return
 
-    def saveUndo(self):
-        self.undoList.append(self.image.copy())
-        self.undoSaved = True
+    def _undo(self):
+        if self.image and self.history.paletteOnly():
+            self.history.undo(self.image)
+            self.repaletted()
+        elif self.image:
+            pixels = self.history.nextBox()
+            if pixels:
+                self.usage.changing(pixels)
+            box = self.history.undo(self.image)
+            if pixels:
+                self.usage.changed(pixels)
+            self.edited(box)
+        return
+
+    def redo(self):
+        self.later(self._redo)
+        return
+
+    def _redo(self):
+        if self.image and self.history.paletteOnly(redo=True):
+            self.history.redo(self.image)
+            self.repaletted()
+        elif self.image:
+            pixels = self.history.nextBox(redo=True)
+            if pixels:
+                self.usage.changing(pixels)
+            box = self.history.redo(self.image)
+            if pixels:
+                self.usage.changed(pixels)
+            self.edited(box)
+        return
+
+    def edited(self, box):
+        # picture changed in box by undo or redo
+        if box:
+            self.regions.changed(self.image, box)
+            self.changed(box)
+            self.saved = False
+            self.changes += 1
+            self.showUsage()
+            if self.journal and self.journal.restored(self.image, box):
+                self.compact()
+        return
+
+    def repaletted(self):
+        # only the palette changed by undo or redo, so no pixels to look at
+        self.recoloured()
+        self.saved = False
+        self.changes += 1
+        self.showUsage()
+        if self.journal and self.journal.recoloured(self.image.getpalette()):
+            self.compact()
+        return
+
+    def compact(self):
+        # start the journal again from a checkpoint of the picture,
+        # once what is already waiting (which may journal more) is done
+        if not self.compacting:
+            self.compacting = True
+            self.later(self._compact)
+        return
+
+    def _compact(self):
+        # the picture is copied now, so the checkpoint has everything
+        # journalled so far and nothing can be journalled until it's written
+        journal, settings = self.journal, self.settings
+        if not journal or not self.image:
+            self.compacting = False
+            return
+        image, saved = self.image.copy(), self.saved
+
+        def done(result):
+            self.compacting = False
+
+        def failed(error):
+            self.compacting = False
+            self.failed(error)
+
+        self.worker.submit(lambda job: journal.compact(image, settings, saved),
+                           done=done, failed=failed, name="checkpoint")
         return
 
     def setImage(self, image):
         # print("setImage")
         self.image = image
-        self.undoSaved = False
+        self.history.clear()  # new picture, new history
+        self.distance = (0, None)  # for gap fills, made when first needed
+        self.regions.start(image)  # label its areas for quick fills
         self.addColours()
-        self.canvas = None  # new image, new canvas
+        self.previewing = False
+        self.setZoom(self.fitZoom(self.image.size))
+        # print("setImage after setZoom")
+        self.resize()
+        # print("setImage-ret")
+        return
+
+    def windowSize(self):
+        # room there is to show the picture in
         w = self.frame.winfo_width()
         h = (self.frame.winfo_height() 
              - self.buttonStrip.winfo_height() 
              - self.colourStrip.winfo_height()
              )
-        width, height = self.image.size
+        return w, h
+
+    def fitZoom(self, size):
+        # zoom (as a percentage) to fit a picture of size in the window
+        w, h = self.windowSize()
+        width, height = size
+        if self.rotated.get():
+            width, height = height, width
         if w < 2 or h < 2:
             w, h = (width, height)
         rw, rh = (w / width, h / height)
         ratio = min(1, rw, rh)
-        # print("setImage: (width, height)", (width, height), 
+        # print("fitZoom: (width, height)", (width, height), 
         #       "w, h", (w, h), "rw, rh", (rw, rh))
-        self.setZoom(ratio * 100)
-        # print("setImage after setZoom")
-        self.resize()
-        # print("setImage-ret")
-        return
+        return ratio * 100
 
     def resize(self):
         # print("resize")
@@ -502,112 +970,223 @@ class ColouringPad(Frame):
 
     def show(self):
         # print("show")
-        self.pictureCanvas(self.width, self.height)
+        # the canvas stays, just showing the picture at the new size
         self.display()
         # print("show-ret")
         return
 
     def display(self):
         # print("display")
-        image = self.image
-        wait = PadWait(self.canvas, "Please wait")
-        wait.label.wait_visibility()
+        # only the visible tiles are rendered, so no need to wait
         try:
-            image = image.quantize(colors=32)  # reduce to max 32 colours
-            # print("Quantized", "size", image.size, "mode", image.mode)
-            image = image.resize((self.width, self.height))
-            self.picture = ImageTk.PhotoImage(image=image)
+            with stats.timed("display"):
+                self.view.setImage(self.image, self.zoom / 100)
+            self.memory.check()
         except Exception as e:
             # print("Exception in display()\n" + str(e))
-            wait.quit()
             PadError("Not enough memory to magnify that far!\n" + str(e))
             self.ok = False
-            image = None
-            self.picture = None
+            self.view.clear()
             # try and recover ...
             gc.collect()
-        if self.ok:
-            self.canvas.create_image(
-                (self.width / 2 + 1, 
-                 self.height / 2 + 1), 
-                image=self.picture)
-        wait.quit()
         # print("display-ret")
         return
 
-    def adjust(self):
-        fudge = 2
-        w, h = self.image.size
-        image = self.image.resize(
-            (int(w / fudge), 
-             int(h / fudge)), 
-            resample=Image.BOX)  # shrink to merge lines (fudge)
-        self.image = image.resize((w, h))  # restore size
-        self.show()
+    def changed(self, box=None):
+        # picture changed in box, so only redisplay that
+        width, height = self.image.size
+        if box is not None:
+            box = (max(0, box[0]), max(0, box[1]),
+                   min(width, box[2]), min(height, box[3]))
+        with stats.timed("redisplay"):
+            self.zoomCache.changed(box)
+            self.view.refresh(box)
+        cap, distance = self.distance
+        if distance and box is None:
+            self.distance = (0, None)
+        elif distance:
+            updateDistance(distance, self.image, box, cap)
+        self.memory.check()
+        return
+
+    def adjust(self, visible=False):
+        self.later(lambda: self._adjust(visible))
+        return
+
+    def _adjust(self, visible):
+        # close the gaps in the lines, everywhere or just those seen
+        if not self.image:
+            return
+        image, gap = self.image, self.gap.get()
+        box = self.view.imageBox(self.view.visible()) if visible else None
+        self.worker.submit(
+            lambda job: lineGaps(image, gap, box),
+            done=lambda found: self.adjusted(image, found, gap, box), 
+            failed=self.failed, name="adjust")
+        return
+
+    def adjusted(self, image, found, gap, area):
+        box, mask, value = found
+        if not box or image is not self.image:
+            return  # nothing to close
+        before = self.image.crop(box)
+        self.image.paste(value, box, mask)
+        self.regions.changed(self.image, box)
+        operation = ("adjust", gap) if area is None else ("adjust", gap, 
+                                                            list(area))
+        self.record(box, before, self.image.getpalette(), operation)
         return
 
     def save(self):
-        if self.image:
+        self.later(self._save)
+        return
+
+    def _save(self):
+        if self.saver.busy():
+            PadInfo("Still saving the last one, try again in a moment.")
+        elif self.image:
             self.filename = filedialog.asksaveasfilename(
                 initialdir=self.lastdir, title="Save picture",
                 filetypes=(("picture files", "*.png"), ("all files", "*.*")), 
                 defaultextension=".png")
             if self.filename != "":
                 self.lastdir = os.path.dirname(self.filename)
-                self.image.save(self.filename)
-                self.saved = True
-                self.undoSaved = False
+                # written from a copy, so colouring can carry on meanwhile
+                image, filename = self.image.copy(), self.filename
+                compression, indexed = self.compression.get(), self.indexed.get()
+                changes = self.changes
+                self.master.title("Colouring Pad - saving " 
+                                  + os.path.basename(filename))
+                self.saver.submit(
+                    lambda job: saveImage(image, filename, compression, indexed),
+                    done=lambda result: self.written(image, changes),
+                    failed=self.notWritten, name="saving")
         else:
             PadError("You will need load or generate a knot first!")
         return
 
-    def colourIt(self):
+    def written(self, image, changes):
+        # the picture has been saved
+        self.master.title("Colouring Pad")
+        if changes == self.changes:  # and not changed since
+            self.saved = True
+            if self.journal:
+                self.compact()
+        return
+
+    def notWritten(self, error):
+        self.master.title("Colouring Pad")
+        PadError("Sorry, couldn't save that!\n" + str(error))
+        return
+
+    def colourIt(self, x, y, mode, chosen):
         if not self.image:
             return  # nothing to do
         # print("colourIt() called")
-        if not self.undoSaved:
-            self.saveUndo()
-        ratio = self.zoom / 100
-        x, y = int(self.tox / ratio), int(self.toy / ratio)
         try:
             target = self.image.getpixel((x, y))
         except IndexError:
             target = None
             # print ("Ignoring click outside picture:", e)
-        if not target:
+        if target is None:
             return  # nothing to do
-        colour = ImageColor.getcolor(self.chosen, self.image.mode)
-        # print("target", target, "(x, y)", (x, y), 
-        #       "chosen", self.chosen, "colour", colour)
-        if self.mode.get() == 1:  # fill
-            self.lastMode = self.mode.get()
-            self.canvas.config(cursor="watch")
-            wait = PadWait(self.canvas, "Please wait")
-            wait.label.wait_visibility()
-            ImageDraw.floodfill(self.image, (x, y), colour)
-            wait.quit()
-            self.canvas.config(cursor="")
-        elif self.mode.get() == 0:  # fix
-            self.lastMode = self.mode.get()
-            delta = int(min(self.image.size) * self.granularity / 2)
-            draw = ImageDraw.Draw(self.image)
-            wait = PadWait(self.canvas, "Please wait")
-            wait.label.wait_visibility()
-            draw.rectangle(
-                (x - delta, y - delta, x + delta, y + delta), 
-                fill=colour)  # draw a blob
-            wait.quit()
-        else:  # dropper
+        if mode == 2:  # dropper
             self.mode.set(self.lastMode)  # reset to what was last used
             # target is colour to use
-            selected = self.colourSelected.get()
-            hexstr = "#%02x%02x%02x" % target
+            hexstr = pixelColour(self.image, (x, y))
             self.colourStrip.setColour(hexstr)
-        self.display()
-        self.saved = False
+            return  # picture not changed
+        # print("target", target, "(x, y)", (x, y), "chosen", chosen)
+        self.lastMode = mode
+        if mode == 1:  # fill, finding where on the worker
+            image, regions = self.image, self.regions
+            tolerance = self.tolerance.get()
+
+            def find(job):
+                found = None
+                if not tolerance:  # just one area, so use the map if it's ready
+                    found = regions.region((x, y))
+                if found is not None:
+                    return True, found
+                return False, region(image, (x, y), tolerance=tolerance,
+                                     check=job.check)
+
+            self.worker.submit(
+                find, 
+                done=lambda result: self.filled(
+                    image, x, y, chosen, ("fill", x, y, chosen, tolerance),
+                    *result),
+                failed=self.failed, name="fill")
+        elif mode == 3:  # fill, but not through small gaps in the lines
+            image, gap = self.image, self.gap.get()
+            tolerance = self.tolerance.get()
+            cap = gap // 2 + 1  # how far from the lines matters
+            known = self.distance if self.distance[0] >= cap else None
+
+            def find(job):
+                if known:
+                    distance = known[1]
+                else:  # once, then kept up to date as the picture changes
+                    with stats.timed("line distance"):
+                        distance = lineDistance(image, cap)
+                return distance, gapRegion(image, (x, y), gap, tolerance,
+                                           distance, check=job.check)
+
+            def done(result):
+                distance, found = result
+                if not known and image is self.image:
+                    self.distance = (cap, distance)
+                self.filled(image, x, y, chosen,
+                            ("gapfill", x, y, chosen, tolerance, gap),
+                            False, found)
+
+            self.worker.submit(find, done=done, failed=self.failed, 
+                               name="gap fill")
+        else:  # fix
+            palette = self.image.getpalette()  # before we add to it
+            colour = colourIndex(self.image, chosen)
+            with stats.timed("fix"):
+                delta = fixDelta(self.image, self.granularity)
+                box = fixBox(self.image, (x, y), delta)
+                before = self.image.crop(box)
+                fixBlob(self.image, (x, y), delta, colour)  # draw a blob
+                self.regions.changed(self.image, box)
+            self.record(box, before, palette, ("fix", x, y, chosen))
         # print("colourIt() ended")
         return
 
+    def filled(self, image, x, y, chosen, operation, quick, found):
+        # worker found the area to fill, so fill it; the colour is only
+        # added to the palette now, so a fill given up on leaves no trace
+        box, mask, count = found
+        if not box or image is not self.image:
+            return
+        palette = self.image.getpalette()  # before we add to it
+        colour = colourIndex(self.image, chosen)
+        before = self.image.crop(box)
+        self.image.paste(colour, box, mask)
+        if quick:
+            self.regions.filled((x, y), colour)
+        else:
+            self.regions.changed(self.image, box)
+        self.record(box, before, palette, operation)
+        return
+
+    def record(self, box, before, palette, operation):
+        # picture changed in box by operation, so keep the undo and show it
+        self.history.record(self.image, box, before, palette)
+        if before is None:  # only the palette changed
+            self.recoloured()
+        else:
+            self.usage.counted(before, self.image.crop(box))
+            self.changed(box)
+        self.showUsage()
+        self.saved = False
+        self.changes += 1
+        if self.journal and self.journal.record(operation):
+            self.compact()
+        return
+
     def pressed(self, event):
         # place where button pressed
         if self.image:
@@ -619,6 +1198,8 @@ class ColouringPad(Frame):
             # so we can see where the selection starts from ...
             self.tox = self.x
             self.toy = self.y
+            if self.mode.get() == 4 and not self.previewing:
+                self.startStroke()
         else:
             PadInfo("No knot yet!")
         return
@@ -629,6 +1210,91 @@ class ColouringPad(Frame):
             # lastx, lasty = self.tox, self.toy
             self.tox, self.toy = self.getPos(event)  # we are now here
             # print("Moved:", self.tox, self.toy)
+            if self.stroke:
+                self.stroke["moves"].append((self.tox, self.toy))
+                if self.stroke["after"] is None:  # draw once a frame
+                    self.stroke["after"] = self.after(self.strokeFrame, 
+                                                      self.drawStroke)
+        return
+
+    def startStroke(self):
+        # start painting with the brush, if nothing else is going on
+        if self.worker.busy() or self.tasks:
+            self.bell()
+            return
+        x, y = self.view.imagePoint(self.x, self.y)
+        palette = self.image.getpalette()  # before we add to it
+        self.stroke = {"points": [(x, y)], "moves": [], "after": None,
+                       "chosen": self.chosen, "palette": palette,
+                       "colour": colourIndex(self.image, self.chosen),
+                       "delta": fixDelta(self.image, self.granularity),
+                       "before": {}, "box": None, "lines": []}
+        self.paint([(x, y)])
+        return
+
+    def paint(self, points):
+        # brush along points, keeping what was there for the undo
+        stroke = self.stroke
+        delta = stroke["delta"]
+        xs, ys = [x for x, y in points], [y for x, y in points]
+        box = (max(0, min(xs) - delta - 1), max(0, min(ys) - delta - 1),
+               min(self.image.width, max(xs) + delta + 2),
+               min(self.image.height, max(ys) + delta + 2))
+        if box[0] >= box[2] or box[1] >= box[3]:
+            return  # off the picture
+        size = self.strokeBlock
+        for row in range(box[1] // size, (box[3] - 1) // size + 1):
+            for col in range(box[0] // size, (box[2] - 1) // size + 1):
+                if (col, row) not in stroke["before"]:
+                    stroke["before"][(col, row)] = self.image.crop(
+                        (col * size, row * size, 
+                         (col + 1) * size, (row + 1) * size))
+        box = brushLine(self.image, points, delta, stroke["colour"])
+        stroke["lines"].append([list(point) for point in points])
+        if stroke["box"]:
+            old = stroke["box"]
+            stroke["box"] = (min(old[0], box[0]), min(old[1], box[1]),
+                             max(old[2], box[2]), max(old[3], box[3]))
+        else:
+            stroke["box"] = box
+        self.changed(box)  # just the new bit of the stroke
+        return
+
+    def drawStroke(self):
+        # draw to where the mouse has got to since the last frame
+        stroke = self.stroke
+        stroke["after"] = None
+        points = [self.view.imagePoint(x, y) for x, y in stroke["moves"]]
+        stroke["moves"] = []
+        if points:
+            self.paint(stroke["points"][-1:] + points)
+            stroke["points"].extend(points)
+        return
+
+    def endStroke(self):
+        # the stroke is done, so it's one undo
+        stroke = self.stroke
+        if stroke["after"] is not None:
+            self.after_cancel(stroke["after"])
+        self.drawStroke()
+        self.stroke = None
+        box = stroke["box"]
+        if box:
+            self.strokeDone(stroke, box)
+        else:  # nothing painted, so take back any colour it added
+            self.image.putpalette(stroke["palette"])
+        self.runTasks()  # anything that waited for the stroke
+        return
+
+    def strokeDone(self, stroke, box):
+        # what was there, from the blocks kept as it was painted
+        before = self.image.crop(box)
+        size = self.strokeBlock
+        for (col, row), block in stroke["before"].items():
+            before.paste(block, (col * size - box[0], row * size - box[1]))
+        self.regions.changed(self.image, box)
+        self.record(box, before, stroke["palette"], 
+                    ("brush", stroke["lines"], stroke["chosen"]))
         return
 
     def getPos(self, event):
@@ -646,7 +1312,17 @@ class ColouringPad(Frame):
             self.tox, self.toy = self.getPos(event)
             # ## print("Released:", self.tox, self.toy)
             self.dragging = False
-            self.colourIt()
+            if self.stroke:
+                self.stroke["moves"].append((self.tox, self.toy))
+                self.endStroke()
+                return
+            if self.previewing or self.mode.get() == 4:
+                return  # nothing to colour (yet)
+            x, y = self.view.imagePoint(self.tox, self.toy)
+            mode, chosen = self.mode.get(), self.chosen
+            # clicks wait their turn, but the same click again is ignored
+            self.later(lambda: self.colourIt(x, y, mode, chosen), 
+                       key=(x, y, mode, chosen))
         else:
             PadInfo("No picture yet!")
         return
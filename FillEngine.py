@@ -0,0 +1,286 @@
+"""
+Flood filling of palette pictures.
+
+Two engines find the area to fill:
+    "pil"   - ImageDraw.floodfill on a mask, a pixel at a time in python
+    "numpy" - a scanline fill over an array, a span at a time
+The numpy engine is used when numpy is available.
+
+Both treat any palette colour within tolerance of the colour
+clicked on as the same colour, and report the box they changed.
+
+gapRegion() uses them to fill without leaking through small gaps in
+the lines, by filling only what is well clear of the lines and then
+growing that back out to them.
+
+Run this module to compare the speed of the engines.
+"""
+import time
+
+from PIL import Image, ImageChops, ImageDraw, ImageFilter
+
+try:
+    import numpy
+except ImportError:  # only the pil engine then
+    numpy = None
+
+_marker = 128  # value the pil engine fills its mask with
+
+
+def _similar(image, xy, tolerance):
+    # lookup table of 255 for the indexes close enough to the one at xy
+    target = image.getpixel(xy)
+    palette = image.getpalette() or []
+    colours = [tuple(palette[i:i + 3]) for i in range(0, len(palette), 3)]
+    lut = [0] * 256
+    lut[target] = 255
+    if tolerance > 0 and target < len(colours):
+        for index, colour in enumerate(colours):
+            if sum(abs(a - b) for a, b in zip(colour, colours[target])) <= tolerance:
+                lut[index] = 255
+    return lut
+
+
+def _pilRegion(image, xy, lut, check):
+    mask = image.point(lut, "L")  # 255 where we may fill, else 0
+    check()
+    ImageDraw.floodfill(mask, xy, _marker)
+    check()
+    mask = mask.point([255 if v == _marker else 0 for v in range(256)])
+    box = mask.getbbox()
+    if box is None:
+        return None, None, 0
+    mask = mask.crop(box)
+    return box, mask, mask.histogram()[255]
+
+
+def _runStarts(cells):
+    # offsets of the start of each run of True in a 1d bool array
+    edges = numpy.diff(cells.astype(numpy.int8), prepend=0)
+    return numpy.flatnonzero(edges == 1)
+
+
+def _numpyRegion(image, xy, lut, check):
+    inside = numpy.asarray(lut, dtype=bool)[numpy.asarray(image)]
+    height, width = inside.shape
+    filled = numpy.zeros_like(inside)
+    left, top, right, bottom = width, height, 0, 0
+    count = 0
+    stack = [(xy[1], xy[0])]
+    spans = 0
+    while stack:
+        y, x = stack.pop()
+        if filled[y, x] or not inside[y, x]:
+            continue
+        spans += 1
+        if spans % 256 == 0:
+            check()
+        row = inside[y]
+        # find the span of fillable cells through x
+        cells = row[x::-1]
+        gap = int(numpy.argmin(cells))  # first unfillable cell, if any
+        start = 0 if cells[gap] else x - gap + 1
+        cells = row[x:]
+        gap = int(numpy.argmin(cells))
+        end = width if cells[gap] else x + gap
+        filled[y, start:end] = True
+        count += end - start
+        left, right = min(left, start), max(right, end)
+        top, bottom = min(top, y), max(bottom, y + 1)
+        # seed each fillable run above and below the span
+        for ny in (y - 1, y + 1):
+            if 0 <= ny < height:
+                cells = inside[ny, start:end] & ~filled[ny, start:end]
+                for offset in _runStarts(cells):
+                    stack.append((ny, start + int(offset)))
+    if count == 0:
+        return None, None, 0
+    box = (left, top, right, bottom)
+    mask = Image.fromarray(filled[top:bottom, left:right].astype(numpy.uint8) * 255)
+    return box, mask, count
+
+
+engines = {"pil": _pilRegion}
+if numpy is not None:
+    engines["numpy"] = _numpyRegion
+defaultEngine = "numpy" if numpy is not None else "pil"
+
+
+def _carryOn():
+    return
+
+
+def region(image, xy, tolerance=0, engine=None, check=None):
+    """
+    Find the area of the palette image to fill from xy.
+
+    Returns (box, mask, count): the box the area lies in, an "L" mask
+    the size of box that is 255 over the area, and the number of pixels
+    in it; or (None, None, 0) if xy is off the picture.
+
+    If given, check() is called every so often and may raise
+    an exception to give up.
+    """
+    x, y = xy
+    if not (0 <= x < image.width and 0 <= y < image.height):
+        return None, None, 0
+    lut = _similar(image, xy, tolerance)
+    return engines[engine or defaultEngine](image, xy, lut, check or _carryOn)
+
+
+def lineDistance(image, cap, dark=128):
+    """
+    Get an "L" image of how far each pixel of the palette image is
+    from the nearest dark (line) pixel, in steps of one pixel either
+    way (including diagonally), up to cap.
+    """
+    palette = image.getpalette() or []
+    lut = [0] * 256
+    for index in range(len(palette) // 3):
+        if sum(palette[3 * index:3 * index + 3]) < 3 * dark:
+            lut[index] = 255
+    grown = image.point(lut, "L")
+    if numpy is not None:
+        return _numpyDistance(numpy.asarray(grown) > 0, cap)
+    distance = Image.new("L", image.size, cap)
+    for step in range(cap):
+        # where lines reach in step steps, and weren't nearer before
+        nearer = grown.point(lambda v: step if v else cap)
+        distance = ImageChops.darker(distance, nearer)
+        grown = grown.filter(ImageFilter.MaxFilter(3))
+    return distance
+
+
+def updateDistance(distance, image, box, cap):
+    """
+    Bring distance, from lineDistance(image, cap), up to date
+    after box of the picture changed.
+    """
+    def grown(box, by):
+        return (max(0, box[0] - by), max(0, box[1] - by),
+                min(image.width, box[2] + by), min(image.height, box[3] + by))
+
+    # distances change up to cap from box, and depend on up to cap further
+    left, top, right, bottom = grown(box, cap)
+    window = grown(box, 2 * cap)
+    part = lineDistance(image.crop(window), cap)
+    distance.paste(part.crop((left - window[0], top - window[1],
+                              right - window[0], bottom - window[1])),
+                   (left, top))
+    return
+
+
+def _spread(cells):
+    # cells and those next to them, 8 ways
+    spread = cells.copy()
+    spread[1:] |= cells[:-1]
+    spread[:-1] |= cells[1:]
+    cells = spread.copy()
+    cells[:, 1:] |= spread[:, :-1]
+    cells[:, :-1] |= spread[:, 1:]
+    return cells
+
+
+def _numpyDistance(lines, cap):
+    distance = numpy.full(lines.shape, cap, dtype=numpy.uint8)
+    for step in range(cap):
+        distance[lines & (distance > step)] = step
+        lines = _spread(lines)
+    return Image.fromarray(distance, "L")
+
+
+def _grow(mask, inside, box, steps, check):
+    # grow the 255s of mask (within box) up to steps pixels
+    # each way, but only over the 255s of inside
+    inside = inside.crop(box)
+    if numpy is not None:
+        cells, inside = numpy.asarray(mask) > 0, numpy.asarray(inside) > 0
+        for _ in range(steps):
+            check()
+            cells = _spread(cells) & inside
+        return Image.fromarray(cells.astype(numpy.uint8) * 255, "L")
+    for _ in range(steps):
+        check()
+        mask = ImageChops.darker(mask.filter(ImageFilter.MaxFilter(3)), inside)
+    return mask
+
+
+def gapRegion(image, xy, gap, tolerance=0, distance=None, engine=None,
+              check=None):
+    """
+    Find the area to fill from xy as region() does, but treating
+    gaps in the lines narrower than gap pixels as closed.
+
+    distance is lineDistance(image, cap) with cap > gap // 2, if
+    already known.  The picture is not changed.  Where xy is too close
+    to a line to tell (or gap is under 2), this is just region().
+    """
+    steps = gap // 2  # pixels in from the lines that could be a gap
+    x, y = xy
+    if steps < 1 or not (0 <= x < image.width and 0 <= y < image.height):
+        return region(image, xy, tolerance, engine, check)
+    check = check or _carryOn
+    if distance is None:
+        distance = lineDistance(image, steps + 1)
+    inside = image.point(_similar(image, xy, tolerance), "L")
+    check()
+    clear = distance.point(lambda v: 255 if v > steps else 0)
+    core = ImageChops.darker(inside, clear)  # well away from the lines
+    if not core.getpixel(xy):
+        return region(image, xy, tolerance, engine, check)
+    box, mask, count = engines[engine or defaultEngine](
+        core, xy, [0] * 255 + [255], check)
+    # and grow back out to the lines
+    left, top, right, bottom = box
+    box = (max(0, left - steps), max(0, top - steps),
+           min(image.width, right + steps), min(image.height, bottom + steps))
+    expanded = Image.new("L", (box[2] - box[0], box[3] - box[1]), 0)
+    expanded.paste(mask, (left - box[0], top - box[1]))
+    mask = _grow(expanded, inside, box, steps, check)
+    found = mask.getbbox()
+    mask = mask.crop(found)
+    box = (box[0] + found[0], box[1] + found[1],
+           box[0] + found[2], box[1] + found[3])
+    return box, mask, mask.histogram()[255]
+
+
+def fill(image, xy, value, tolerance=0, engine=None):
+    """
+    Flood fill the palette image from xy with index value.
+
+    Returns (box, count): the box that changed (or None) and
+    the number of pixels filled.
+    """
+    box, mask, count = region(image, xy, tolerance, engine)
+    if box is not None:
+        image.paste(value, box, mask)
+    return box, count
+
+
+def _outline(size):
+    # a test picture: a grid of cells inside a big ring
+    image = Image.new("P", size, 0)
+    image.putpalette([255, 255, 255, 0, 0, 0, 255, 0, 0])
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    step = max(8, min(size) // 20)
+    for x in range(0, width // 2, step):
+        draw.line((x, 0, x, height // 2), fill=1, width=2)
+    for y in range(0, height // 2, step):
+        draw.line((0, y, width // 2, y), fill=1, width=2)
+    draw.ellipse((width // 4, height // 4, width - 4, height - 4),
+                 outline=1, width=3)
+    return image
+
+
+if __name__ == "__main__":
+    # compare the engines filling the background and a cell
+    for size in ((500, 500), (1000, 1000), (2000, 2000)):
+        for name in engines:
+            for xy in ((size[0] - 2, 1), (size[0] // 20 + 3, size[1] // 20 + 3)):
+                image = _outline(size)
+                start = time.perf_counter()
+                box, count = fill(image, xy, 2, engine=name)
+                took = time.perf_counter() - start
+                print("%-6s %-12s fill at %-12s %9d pixels %8.3fs"
+                      % (name, "%dx%d" % size, xy, count, took))
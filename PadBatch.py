@@ -0,0 +1,143 @@
+"""
+Colour a directory of pictures without the colouring pad window.
+
+Each picture is loaded (reduced to a palette, with rare colours merged
+in to common ones nearby) as the colouring pad does, has the operations in a script applied to it, and is saved to
+the output directory as soon as it is done.  Pictures are spread over
+a pool of processes and the time each took is reported as it finishes.
+
+The script is a text file with one operation per line:
+    fill x y colour [tolerance]
+    fix x y colour
+    adjust [gap]
+where x and y are pixels, or percentages of the picture size if they
+end in "%", colour is a name or #rrggbb and gap is the widest gap in
+the lines to close (default 3).  Blank lines and anything
+after a "#" followed by a space (or a line starting "#") are ignored, eg:
+    # white background, whatever the size
+    adjust
+    fill 0 0 white
+    fill 50% 50% #ffe0e0 32
+"""
+import argparse
+import fnmatch
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PadImage import loadImage, applyOperation, saveImage, mergeDistance
+
+
+def parseScript(lines):
+    """
+    Parse the lines of a script in to a list of operations.
+    Positions are left as strings, as percentages depend on the picture.
+    """
+    operations = []
+    for number, line in enumerate(lines, 1):
+        line = line.split("# ")[0].strip()
+        if not line or line.startswith("#"):
+            continue
+        words = line.split()
+        name = words[0].lower()
+        try:
+            if name == "fill" and len(words) in (4, 5):
+                tolerance = int(words[4]) if len(words) == 5 else 0
+                operations.append(("fill", words[1], words[2], words[3],
+                                   tolerance))
+            elif name == "fix" and len(words) == 4:
+                operations.append(("fix", words[1], words[2], words[3]))
+            elif name == "adjust" and len(words) in (1, 2):
+                gap = int(words[1]) if len(words) == 2 else 3
+                operations.append(("adjust", gap))
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError("Line %d: can't understand: %s"
+                             % (number, line)) from None
+    return operations
+
+
+def _position(value, size):
+    if value.endswith("%"):
+        return min(size - 1, int(size * float(value[:-1]) / 100))
+    return int(value)
+
+
+def colourFile(filename, output, operations, distance=mergeDistance):
+    """
+    Colour one picture, saving it to output, with rare colours within
+    distance merged as it is loaded (0 for none).
+    Returns the times taken to load, colour and save it.
+    """
+    start = time.perf_counter()
+    image = loadImage(filename, distance=distance)
+    loaded = time.perf_counter()
+    for operation in operations:
+        if operation[0] in ("fill", "fix"):
+            x = _position(operation[1], image.width)
+            y = _position(operation[2], image.height)
+            operation = (operation[0], x, y) + operation[3:]
+        image = applyOperation(image, operation)
+    coloured = time.perf_counter()
+    saveImage(image, output)
+    saved = time.perf_counter()
+    return loaded - start, coloured - loaded, saved - coloured
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Colour a directory of pictures with a script of operations.")
+    parser.add_argument("script", help="file of operations to apply")
+    parser.add_argument("directory", help="directory of pictures to colour")
+    parser.add_argument("-o", "--output", default=None,
+                        help="directory to save to (default: directory/coloured)")
+    parser.add_argument("-p", "--pattern", default="*.png",
+                        help="pictures to colour (default: *.png)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of processes (default: one per cpu)")
+    parser.add_argument("-m", "--merge", type=int, default=mergeDistance,
+                        metavar="DISTANCE",
+                        help="merge rare colours in to common ones this close "
+                             "(default: %(default)s)")
+    parser.add_argument("--no-merge", dest="merge", action="store_const",
+                        const=0, help="keep rare colours as they are")
+    args = parser.parse_args(args)
+    with open(args.script) as script:
+        try:
+            operations = parseScript(script)
+        except ValueError as e:
+            parser.error("%s: %s" % (args.script, e))
+    output = args.output or os.path.join(args.directory, "coloured")
+    os.makedirs(output, exist_ok=True)
+    names = sorted(name for name in os.listdir(args.directory)
+                   if fnmatch.fnmatch(name, args.pattern)
+                   and os.path.isfile(os.path.join(args.directory, name)))
+    failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        jobs = {}
+        for name in names:
+            target = os.path.join(output, os.path.splitext(name)[0] + ".png")
+            job = pool.submit(colourFile, os.path.join(args.directory, name),
+                              target, operations, args.merge)
+            jobs[job] = name
+        for job in as_completed(jobs):
+            name = jobs[job]
+            try:
+                load, colour, save = job.result()
+            except Exception as e:
+                failed += 1
+                print("%s: failed: %s" % (name, e), file=sys.stderr)
+            else:
+                print("%s: load %.3fs colour %.3fs save %.3fs total %.3fs"
+                      % (name, load, colour, save, load + colour + save))
+            sys.stdout.flush()
+    print("%d pictures, %d failed, in %.3fs"
+          % (len(names), failed, time.perf_counter() - start))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""
+Benchmarks for the colouring pad, run without any window.
+
+Makes clean synthetic outline pictures (many small cells, a few huge
+areas and some gappy lines) of each size asked for, then times loading,
+labelling, filling, fixing, adjusting, zooming and displaying them.
+Each size is run in a fresh process, and the peak memory each operation
+needs over what was in use before it is reported.
+
+Results are written as JSON so that runs from different commits can
+be compared:
+    python PadBench.py -o before.json
+    ... change things ...
+    python PadBench.py -o after.json
+    python PadBench.py --compare before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import PIL
+from PIL import Image, ImageDraw
+
+from FillEngine import fill
+from PadImage import loadImage, colourIndex, fixDelta, fixBlob, closeGaps
+from RegionMap import RegionMap, label, numpy
+from ZoomCache import ZoomCache, zoomedSize
+
+defaultSizes = (1, 4, 16, 100)  # mega pixels
+window = (1280, 800)  # pixels shown by the display benchmark
+
+
+def outline(megapixels, seed=1):
+    """
+    Make a clean synthetic outline of about megapixels million pixels,
+    as a scan looks once reduced to its palette.
+
+    Returns the RGB picture and a dict of useful places to click:
+    "background" in the huge area round everything,
+    "cell" in one of the small cells and "ring" inside a big ring.
+    """
+    rand = random.Random(seed)
+    side = int((megapixels * 1000000) ** 0.5)
+    width, height = side * 4 // 3, side * 3 // 4
+    line = max(2, side // 800)
+    image = Image.new("L", (width, height), 250)
+    draw = ImageDraw.Draw(image)
+    # many small cells in the top left
+    step = max(12, side // 80)
+    for x in range(step, width // 2, step):
+        draw.line((x, step, x, height // 2), fill=20, width=line)
+    for y in range(step, height // 2, step):
+        draw.line((step, y, width // 2, y), fill=20, width=line)
+    # a few huge areas
+    draw.ellipse((width // 2 + step, step, width - step, height // 2),
+                 outline=20, width=line)
+    draw.ellipse((step, height // 2 + step, width // 2, height - step),
+                 outline=20, width=line)
+    draw.rectangle((width // 2 + step, height // 2 + step,
+                    width - step, height - step), outline=20, width=line)
+    # gappy lines inside the rectangle
+    for _ in range(20):
+        x = rand.randrange(width // 2 + 2 * step, width - 2 * step)
+        y = rand.randrange(height // 2 + 2 * step, height - 2 * step)
+        length = rand.randrange(step, 10 * step)
+        for start in range(0, length, 2 * step):
+            draw.line((x + start, y, x + start + step - rand.randrange(1, 3), y),
+                      fill=20, width=line)
+    places = {"background": (width - 2, height - 2),
+              "cell": (step + step // 2, step + step // 2),
+              "ring": (width * 3 // 4, height // 4)}
+    return image.convert("RGB"), places
+
+
+def _resetPeak():
+    # start measuring peak memory again (linux only)
+    try:
+        with open("/proc/self/clear_refs", "w") as refs:
+            refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _memory():
+    # (resident, peak resident) memory in KiB, peak since the last
+    # reset where that can be done, otherwise ever
+    resident = peak = None
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    resident = int(line.split()[1])
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1])
+    except OSError:
+        pass
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return resident if resident is not None else peak, peak
+
+
+def _time(operation, prepare=None, repeat=3):
+    # time operation(prepare()) repeat times, measuring the most memory
+    # it needed over what was in use before it started
+    times = []
+    extra = 0
+    for _ in range(repeat):
+        state = prepare() if prepare else None
+        reset = _resetPeak()
+        before, peakBefore = _memory()
+        start = time.perf_counter()
+        operation(state)
+        times.append(time.perf_counter() - start)
+        after, peak = _memory()
+        # without a reset the peak only shows if it beat the old one
+        extra = max(extra, peak - (before if reset else peakBefore))
+    return {"min": min(times), "median": statistics.median(times),
+            "max": max(times), "extraKiB": extra}
+
+
+def runSize(megapixels, repeat=3):
+    """
+    Run every benchmark on one size of picture, returning a dict
+    of operation name to timings.
+    """
+    rgb, places = outline(megapixels)
+    results = {"pixels": rgb.width * rgb.height}
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, "outline.png")
+        rgb.save(filename, compress_level=1)
+        del rgb
+        results["load"] = _time(lambda state: loadImage(filename), repeat=repeat)
+        image = loadImage(filename)
+    results["label"] = _time(lambda state: label(numpy.asarray(image)),
+                             repeat=repeat) if numpy is not None else None
+    for name, xy in places.items():
+        results["fill " + name] = _time(
+            lambda state: fill(state, xy, colourIndex(state, "red")),
+            prepare=image.copy, repeat=repeat)
+    if numpy is not None:
+        for name in ("cell", "background"):
+            # the whole fill through the map, as a click does once it's ready
+            results["quick fill " + name] = _time(
+                lambda state: _quickFill(state, places[name]),
+                prepare=lambda: _labelled(image), repeat=repeat)
+    delta = fixDelta(image, 2 / 1000)
+    results["fix"] = _time(
+        lambda state: fixBlob(state, places["cell"], delta, 0),
+        prepare=image.copy, repeat=repeat)
+    results["adjust"] = _time(lambda state: closeGaps(state),
+                              prepare=image.copy, repeat=repeat)
+    for zoom in (0.5, 2):
+        size = zoomedSize(image, zoom)
+        results["zoom %g" % zoom] = _time(
+            lambda state: image.resize(size, resample=Image.NEAREST),
+            repeat=repeat)
+    results["display"] = _time(lambda state: _display(image, 0.5), repeat=repeat)
+    return results
+
+
+def _labelled(image):
+    # a copy of image with its region map ready
+    image = image.copy()
+    regions = RegionMap()
+    regions.start(image)
+    while not regions.ready():
+        time.sleep(0.01)
+    return image, regions
+
+
+def _quickFill(state, xy):
+    image, regions = state
+    box, count = regions.fill(image, xy, colourIndex(image, "red"))
+    return box, count
+
+
+def _display(image, zoom):
+    # render a window full of tiles, as the view does, with a fresh cache
+    cache = ZoomCache()
+    cache.setImage(image)
+    tile = 256
+    width, height = zoomedSize(image, zoom)
+    for top in range(0, min(height, window[1]), tile):
+        for left in range(0, min(width, window[0]), tile):
+            cache.tile(zoom, (left, top, min(width, left + tile),
+                              min(height, top + tile))).convert("RGB")
+    return
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before, after):
+    """
+    Print how the timings in two result files compare.
+    """
+    with open(before) as file:
+        old = json.load(file)
+    with open(after) as file:
+        new = json.load(file)
+    print("%-32s %10s %10s %8s" % ("", old["commit"], new["commit"], "ratio"))
+    for size, results in new["results"].items():
+        for name, timing in results.items():
+            was = old["results"].get(size, {}).get(name)
+            if not isinstance(timing, dict) or not isinstance(was, dict):
+                continue
+            print("%-32s %9.3fs %9.3fs %7.2fx"
+                  % ("%sMP %s" % (size, name), was["median"], timing["median"],
+                     timing["median"] / max(was["median"], 1e-9)))
+    return
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark the colouring pad.")
+    parser.add_argument("-s", "--sizes", default=",".join(map(str, defaultSizes)),
+                        help="comma separated picture sizes in mega pixels "
+                             "(default: %(default)s)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="times to run each operation (default: 3)")
+    parser.add_argument("-o", "--output", default="bench.json",
+                        help="file to write the results to (default: bench.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="compare two result files instead")
+    args = parser.parse_args(args)
+    if args.compare:
+        compare(*args.compare)
+        return 0
+    report = {"commit": _commit(),
+              "when": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(),
+              "pillow": PIL.__version__,
+              "numpy": numpy.__version__ if numpy is not None else None,
+              "machine": platform.platform(),
+              "results": {}}
+    for size in args.sizes.split(","):
+        megapixels = float(size)
+        # a fresh process for each size, so memory peaks are its own
+        with ProcessPoolExecutor(max_workers=1,
+                                 mp_context=get_context("spawn")) as pool:
+            results = pool.submit(runSize, megapixels, args.repeat).result()
+        report["results"][size] = results
+        for name, timing in results.items():
+            if isinstance(timing, dict):
+                print("%6sMP %-26s %8.3fs %9d KiB"
+                      % (size, name, timing["median"], timing["extraKiB"]))
+        sys.stdout.flush()
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=1)
+    print("Results written to", args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""
+A gallery of thumbnails of the pictures in a directory, to pick one from.
+
+Thumbnails are made by a pool of processes and kept in cacheDir with an
+index keyed by each picture's path, modification time and size, so a
+directory is only slow to show the first time.  Only the rows that can
+be seen have their thumbnails shown, so big directories scroll freely.
+"""
+import fnmatch
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from tkinter import Toplevel, Canvas, Button, NW, VERTICAL, E, W, N, S
+from tkinter import ttk
+
+from PIL import Image, ImageTk
+
+from PadImage import cacheDir
+
+thumbSize = 128  # pixels each way
+patterns = ("*.png", "*.jpg", "*.jpeg", "*.gif", "*.bmp", "*.tif", "*.tiff")
+
+
+def makeThumbnail(filename, target):
+    """
+    Make a thumbnail of the picture in filename, saving it as target.
+    Run in a separate process.
+    """
+    image = Image.open(filename)
+    image.draft("RGB", (thumbSize, thumbSize))  # quicker for JPEGs
+    image = image.convert("RGB")
+    image.thumbnail((thumbSize, thumbSize), reducing_gap=2.0)
+    temp = target + ".tmp"
+    image.save(temp, "PNG")
+    os.replace(temp, target)
+    return target
+
+
+class ThumbIndex:
+    """
+    Which thumbnail in folder is of which version of which picture.
+    """
+
+    def __init__(self, folder=os.path.join(cacheDir, "thumbnails")):
+        self.folder = folder
+        self.filename = os.path.join(folder, "index.json")
+        try:
+            with open(self.filename) as file:
+                self._index = json.load(file)
+        except (OSError, ValueError):
+            self._index = {}  # path -> [mtime, size, thumbnail]
+        self._changed = False
+        return
+
+    @staticmethod
+    def _version(path):
+        info = os.stat(path)
+        return [info.st_mtime, info.st_size]
+
+    def lookup(self, path):
+        """
+        Get the thumbnail of the picture at path, or None
+        if there isn't one of this version of it.
+        """
+        entry = self._index.get(path)
+        try:
+            if entry and entry[0:2] == self._version(path) \
+                    and os.path.exists(entry[2]):
+                return entry[2]
+        except OSError:
+            pass
+        return None
+
+    def target(self, path):
+        """
+        Get where the thumbnail of the current version of path goes.
+        """
+        key = json.dumps([path] + self._version(path))
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".png"
+        return os.path.join(self.folder, name)
+
+    def add(self, path, thumbnail):
+        """
+        Index thumbnail as that of path, unless path has gone.
+        """
+        try:
+            version = self._version(path)
+        except OSError:
+            return  # removed or renamed since the thumbnail was made
+        old = self._index.get(path)
+        if old and old[2] != thumbnail:
+            try:
+                os.remove(old[2])  # of an old version
+            except OSError:
+                pass
+        self._index[path] = version + [thumbnail]
+        self._changed = True
+        return
+
+    def save(self):
+        if self._changed:
+            try:
+                temp = self.filename + ".tmp"
+                with open(temp, "w") as file:
+                    json.dump(self._index, file)
+                os.replace(temp, self.filename)
+            except OSError:
+                pass  # only costs time
+            self._changed = False
+        return
+
+
+class PadGallery:
+    """
+    A window of thumbnails of the pictures in folder.
+    Clicking on one calls chosen(path) and closes the window.
+    """
+
+    columns = 5
+    cell = thumbSize + 24  # room for the name under each thumbnail
+    poll = 100  # ms between looking for finished thumbnails
+
+    def __init__(self, parent, folder, chosen, closed=None):
+        self.chosen = chosen
+        self.closed = closed
+        self.folder = folder
+        top = self.top = Toplevel(parent)
+        top.title("Colouring Pad - " + folder)
+        top.protocol("WM_DELETE_WINDOW", self.quit)
+        self.canvas = Canvas(top, width=self.columns * self.cell,
+                             height=3 * self.cell)
+        self.canvas.grid(column=0, row=0, sticky=(N, W, E, S))
+        bar = ttk.Scrollbar(top, orient=VERTICAL, command=self.canvas.yview)
+        bar.grid(column=1, row=0, sticky=(N, S))
+        self._bar = bar
+        self.canvas.config(yscrollcommand=self._scrolled)
+        Button(top, text="Close", command=self.quit).grid(
+            column=0, row=1, columnspan=2, pady=5, padx=5)
+        top.grid_columnconfigure(0, weight=1)
+        top.grid_rowconfigure(0, weight=1)
+        self.canvas.bind("<ButtonRelease-1>", self._clicked)
+        self.index = ThumbIndex()
+        os.makedirs(self.index.folder, exist_ok=True)
+        self.paths = sorted(
+            os.path.join(folder, name) for name in os.listdir(folder)
+            if any(fnmatch.fnmatch(name.lower(), p) for p in patterns)
+            and os.path.isfile(os.path.join(folder, name)))
+        self._thumbs = {}  # number -> thumbnail file, once made
+        self._shown = {}  # number -> (PhotoImage, canvas item)
+        self._jobs = {}  # future -> number
+        self._pending = None
+        self._open = True
+        self._layout()
+        self._pool = None
+        missing = []
+        for number, path in enumerate(self.paths):
+            thumb = self.index.lookup(path)
+            if thumb:
+                self._thumbs[number] = thumb
+            else:
+                missing.append(number)
+        if missing:
+            self._pool = ProcessPoolExecutor(mp_context=get_context("spawn"))
+            for number in missing:
+                path = self.paths[number]
+                try:
+                    job = self._pool.submit(makeThumbnail, path,
+                                            self.index.target(path))
+                except OSError:
+                    continue  # gone already
+                self._jobs[job] = number
+            top.after(self.poll, self._check)
+        self._schedule()
+        return
+
+    def _layout(self):
+        # a frame and name for each picture, thumbnails come later
+        rows = (len(self.paths) + self.columns - 1) // self.columns
+        self.canvas.config(scrollregion=(0, 0, self.columns * self.cell,
+                                         rows * self.cell))
+        for number, path in enumerate(self.paths):
+            x, y = self._place(number)
+            self.canvas.create_rectangle(x + 2, y + 2, x + thumbSize + 6,
+                                         y + thumbSize + 6, outline="grey")
+            self.canvas.create_text(x + self.cell // 2, y + thumbSize + 14,
+                                    text=os.path.basename(path)[:20])
+        return
+
+    def _place(self, number):
+        row, column = divmod(number, self.columns)
+        return column * self.cell, row * self.cell
+
+    def _scrolled(self, first, last):
+        self._bar.set(first, last)
+        self._schedule()
+        return
+
+    def _schedule(self):
+        if self._pending is None:
+            self._pending = self.top.after_idle(self.update)
+        return
+
+    def _visible(self):
+        # numbers of the pictures in (or a row either side of) view
+        top = self.canvas.canvasy(0)
+        height = max(self.canvas.winfo_height(), int(self.canvas["height"]))
+        first = max(0, int(top // self.cell) - 1) * self.columns
+        last = (int((top + height) // self.cell) + 2) * self.columns
+        return range(first, min(last, len(self.paths)))
+
+    def update(self):
+        """
+        Show the thumbnails that can be seen and forget the rest.
+        """
+        self._pending = None
+        if not self._open:
+            return
+        visible = self._visible()
+        for number in list(self._shown):
+            if number not in visible:
+                self.canvas.delete(self._shown.pop(number)[1])
+        for number in visible:
+            if number in self._thumbs and number not in self._shown:
+                try:
+                    photo = ImageTk.PhotoImage(Image.open(self._thumbs[number]))
+                except OSError:
+                    continue
+                x, y = self._place(number)
+                offset = (thumbSize - photo.width()) // 2 + 4
+                item = self.canvas.create_image(x + offset, y + 4,
+                                                image=photo, anchor=NW)
+                self._shown[number] = (photo, item)
+        return
+
+    def _check(self):
+        # collect any finished thumbnails
+        if not self._open:
+            return
+        for job in [job for job in self._jobs if job.done()]:
+            number = self._jobs.pop(job)
+            try:
+                thumb = job.result()
+            except Exception:
+                continue  # not a picture we can read
+            self._thumbs[number] = thumb
+            self.index.add(self.paths[number], thumb)
+        self._schedule()
+        if self._jobs:
+            self.top.after(self.poll, self._check)
+        else:
+            self.index.save()
+            self._pool.shutdown(wait=False)  # its processes aren't needed
+            self._pool = None
+        return
+
+    def _clicked(self, event):
+        x, y = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
+        column, row = int(x // self.cell), int(y // self.cell)
+        number = row * self.columns + column
+        if 0 <= column < self.columns and 0 <= number < len(self.paths):
+            path = self.paths[number]
+            self.quit()
+            self.chosen(path)
+        return
+
+    def quit(self):
+        self._open = False
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self._jobs = {}
+        self.index.save()
+        self.top.destroy()
+        if self.closed:
+            self.closed()
+        return
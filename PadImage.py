@@ -0,0 +1,565 @@
+"""
+Handling of the picture being coloured, without any tkinter.
+
+The picture is kept as a palette ("P" mode) image, so each pixel
+is an index in to its palette, and the palette is the one place
+that holds the colours.  Filling, fixing and the dropper all work
+with palette indexes, so nothing needs quantizing once loaded.
+"""
+import hashlib
+import json
+import math
+import os
+
+from PIL import (Image, ImageChops, ImageColor, ImageDraw, ImageFilter,
+                 PngImagePlugin)
+
+from FillEngine import fill, gapRegion, numpy
+from PadStats import stats
+
+paletteSize = 32  # number of colours a loaded picture is reduced to
+binBits = 5  # bits of each of red, green and blue the analyser tells apart
+apart = 24  # least distance between the colours the analyser first picks
+cacheDir = os.path.join(os.path.expanduser("~"), ".cache", "ColouringPad")
+cacheFiles = 100  # most analysed pictures kept in the cache
+mergeDistance = 20  # L*a*b* distance within which a rare colour merges at load
+
+
+def _openReduced(filename, maxPixels):
+    # open filename, cheaply cut down to about maxPixels if need be
+    image = Image.open(filename)
+    image.info.pop("transparency", None)  # meaningless once RGB
+    pixels = image.width * image.height
+    if not maxPixels or pixels <= maxPixels:
+        return image.convert("RGB")
+    scale = (maxPixels / pixels) ** 0.5
+    size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+    if image.format == "JPEG":  # decode at a fraction of the size
+        image.draft("RGB", size)
+    image = image.convert("RGB")
+    factor = min(image.width // size[0], image.height // size[1])
+    if factor > 1:  # whole steps are quick
+        image = image.reduce(factor)
+    if image.size != size:
+        image = image.resize(size, resample=Image.BOX)
+    return image
+
+
+def _binValues():
+    # the lookup table taking each value to the middle of its bin
+    # (well, to the value with its top bits repeated, so 0 and 255 stay)
+    drop = 8 - binBits
+    return [(v >> drop << drop) | (v >> drop >> (binBits - drop))
+            for v in range(256)]
+
+
+def _pickPalette(colours, size):
+    """
+    Pick the size colours that best cover colours, a list of
+    (count, (r, g, b)) of the colours in a picture.
+
+    The most used colours are taken first, skipping any within apart
+    of one already taken (so the noise round black and white doesn't
+    use up the palette), then each is moved to the (weighted) middle
+    of the colours closest to it.
+    """
+    colours = sorted(colours, reverse=True)
+    if numpy is not None:  # the same, a colour at a time but vectorized
+        counts = numpy.array([count for count, rgb in colours], dtype=float)
+        rgbs = numpy.array([rgb[0:3] for count, rgb in colours], dtype=float)
+        free = numpy.ones(len(colours), dtype=bool)
+        picked = []
+        while len(picked) < size and free.any():
+            first = int(numpy.argmax(free))
+            picked.append(first)
+            free &= ((rgbs - rgbs[first]) ** 2).sum(axis=1) > apart * apart
+        centres = rgbs[picked]
+        nearest = ((rgbs[:, None, :] - centres[None, :, :]) ** 2
+                   ).sum(axis=2).argmin(axis=1)
+        weights = numpy.bincount(nearest, weights=counts, minlength=len(picked))
+        sums = numpy.stack([numpy.bincount(nearest, weights=counts * rgbs[:, band],
+                                           minlength=len(picked))
+                            for band in range(3)], axis=1)
+        return [tuple(int(v) for v in numpy.rint(total / weight))
+                for total, weight in zip(sums, weights)]
+    picked = []
+    for count, rgb in colours:
+        if all(sum((a - b) ** 2 for a, b in zip(rgb, other)) > apart * apart
+               for other in picked):
+            picked.append(rgb[0:3])
+            if len(picked) == size:
+                break
+    totals = [[0, 0, 0, 0] for _ in picked]
+    for count, rgb in colours:
+        total = totals[_nearest(picked, rgb)]
+        total[0] += count
+        for band in range(3):
+            total[band + 1] += count * rgb[band]
+    return [tuple(int(round(value / total[0])) for value in total[1:])
+            for total in totals]
+
+
+def _nearest(colours, rgb):
+    return min(range(len(colours)),
+               key=lambda i: sum((a - b) ** 2 for a, b in zip(colours[i], rgb)))
+
+
+def reduceColours(image, size=paletteSize):
+    """
+    Reduce the RGB image to a palette image of at most size colours,
+    returning it and the number of pixels using each palette index.
+
+    The palette is picked from a histogram of the picture's colours
+    (see _pickPalette()), made in one pass: of the colours themselves
+    if there are few enough, as in most outlines, otherwise of them cut
+    to binBits bits each.  Then every pixel is given its nearest colour.
+    """
+    with stats.timed("reduce colours"):
+        colours = image.getcolors(1 << (3 * binBits))
+        if colours is None:  # too many, so bin them
+            image = image.point(_binValues() * 3)
+            colours = image.getcolors(1 << (3 * binBits))
+        palette = [value for rgb in _pickPalette(colours, size)
+                   for value in rgb]
+        like = Image.new("P", (1, 1))
+        like.putpalette(palette)
+        reduced = image.quantize(palette=like, dither=Image.Dither.NONE)
+        reduced.putpalette(palette)
+        return reduced, reduced.histogram()
+
+
+def loadImage(filename, maxPixels=0, distance=mergeDistance):
+    """
+    Load the picture in filename as a palette image of
+    at most paletteSize colours, scaled down to no more than
+    maxPixels pixels if that is given, with rare colours merged
+    in to common ones within distance (see mergeColours()).
+    """
+    with stats.timed("load"):
+        image = _openReduced(filename, maxPixels)
+    image, counts = reduceColours(image)
+    return mergeColours(image, counts, distance)[0]
+
+
+def previewImage(filename, size):
+    """
+    Get a quick rough RGB copy of the picture in filename
+    to show in a window of size while the real one loads,
+    or None if the picture is small enough to load quickly.
+
+    Only JPEGs can be decoded at a fraction of their size, so
+    anything else gets None too, rather than being decoded in full
+    twice; those are previewed from the one full decode instead,
+    with previewCopy() as analyseImage() reports it.
+    """
+    with stats.timed("preview"):
+        image = Image.open(filename)
+        factor = min(image.width // size[0], image.height // size[1])
+        if factor < 2 or image.format != "JPEG":
+            return None
+        return _openReduced(filename, image.width * image.height
+                            // (factor * factor))
+
+
+def previewCopy(image, size):
+    """
+    Get a rough copy of image, as just decoded, to show in a window
+    of size, or None if it is small enough to load quickly.
+    """
+    factor = min(image.width // size[0], image.height // size[1])
+    if factor < 2:
+        return None
+    with stats.timed("preview"):
+        return image.reduce(factor)
+
+
+def fileHash(filename):
+    """
+    Get a hex digest of the contents of filename.
+    """
+    digest = hashlib.sha1()
+    with open(filename, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def analyseImage(filename, maxPixels=0, distance=mergeDistance, decoded=None):
+    """
+    Load the picture in filename as loadImage() does, returning it
+    and the number of pixels using each palette index.
+
+    Both are cached (in cacheDir) by the contents of the file, before
+    rare colours are merged, so loading the same picture again (with
+    any distance) skips the reducing and counting.
+    Otherwise decoded(image), if given, is called with the full colour
+    picture as soon as it is decoded, before the slow part.
+    """
+    key = "%s-%d-%d-%d" % (fileHash(filename), paletteSize, binBits, maxPixels)
+    cached = os.path.join(cacheDir, key + ".png")
+    try:
+        with stats.timed("cached load"):
+            image = Image.open(cached)
+            image.load()
+            counts = json.loads(image.info.pop("counts"))
+        os.utime(cached)  # so it is kept as recently used
+        return mergeColours(image, counts, distance)
+    except (OSError, KeyError, ValueError):
+        pass  # not there (or broken), so do it the long way
+    with stats.timed("load"):
+        image = _openReduced(filename, maxPixels)
+    if decoded is not None:
+        decoded(image)
+    image, counts = reduceColours(image)
+    _cache(cached, image, counts)
+    return mergeColours(image, counts, distance)
+
+
+def _cache(filename, image, counts):
+    # keep image and counts in the cache, forgetting the oldest
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        info = PngImagePlugin.PngInfo()
+        info.add_text("counts", json.dumps(counts))
+        temp = filename + ".tmp"
+        image.save(temp, "PNG", pnginfo=info, compress_level=1)
+        os.replace(temp, filename)
+        names = [os.path.join(cacheDir, name) for name in os.listdir(cacheDir)
+                 if name.endswith(".png")]
+        names.sort(key=os.path.getmtime, reverse=True)
+        for name in names[cacheFiles:]:
+            os.remove(name)
+    except OSError:
+        pass  # the cache is only to save time
+    return
+
+
+def saveImage(image, filename, compression=6, indexed=True):
+    """
+    Save image to filename, in the format its extension says.
+
+    A PNG is saved with compression (0 to 9) and, if indexed, as a
+    palette PNG rather than full colour.  The picture is written to
+    a temporary file first and then renamed, so filename is never
+    left half written.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    format = Image.registered_extensions().get(extension, "PNG")
+    temp = filename + ".tmp"
+    with stats.timed("save"):
+        try:
+            if format == "PNG":
+                image = image if indexed else image.convert("RGB")
+                image.save(temp, format, compress_level=compression)
+            else:  # most formats don't do palettes
+                image.convert("RGB").save(temp, format)
+            os.replace(temp, filename)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+    return
+
+
+def hexColour(rgb):
+    """
+    Get the #rrggbb string for an (r, g, b) colour.
+    """
+    return "#%02x%02x%02x" % tuple(rgb[0:3])
+
+
+def paletteColours(image):
+    """
+    Get the palette of image as a list of (r, g, b) colours,
+    one for each index.
+    """
+    palette = image.getpalette() or []
+    return [tuple(palette[i:i + 3]) for i in range(0, len(palette), 3)]
+
+
+def usedColours(image, enough=0, counts=None):
+    """
+    Get the #rrggbb strings of the colours used by more
+    than enough pixels of image (counts being its histogram,
+    if already known).
+    """
+    if counts is None:
+        counts = image.histogram()
+    used = []
+    for index, rgb in enumerate(paletteColours(image)):
+        if counts[index] > enough:
+            colour = hexColour(rgb)
+            if colour not in used:
+                used.append(colour)
+    return used
+
+
+def _lab(rgb):
+    # CIE L*a*b* of an sRGB colour (D65 white)
+    linear = []
+    for value in rgb:
+        value /= 255
+        linear.append(value / 12.92 if value <= 0.04045
+                      else ((value + 0.055) / 1.055) ** 2.4)
+    r, g, b = linear
+    xyz = ((0.4124 * r + 0.3576 * g + 0.1805 * b) / 0.9505,
+           0.2126 * r + 0.7152 * g + 0.0722 * b,
+           (0.0193 * r + 0.1192 * g + 0.9505 * b) / 1.0890)
+    fx, fy, fz = (v ** (1 / 3) if v > 0.008856 else 7.787 * v + 16 / 116
+                  for v in xyz)
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+def mergeColours(image, counts, distance=mergeDistance, rare=1 / 100):
+    """
+    Merge each palette colour used by fewer than rare of the pixels
+    in to the nearest colour used by more, if that is within distance
+    in L*a*b* (so eg nearly black becomes black).
+
+    Every pixel is remapped in one pass through a lookup table.
+    Returns the new picture and its counts.
+    """
+    enough = image.width * image.height * rare
+    colours = paletteColours(image)
+    common = [i for i in range(len(colours)) if counts[i] >= enough]
+    if not distance or not common:
+        return image, counts
+    labs = [_lab(rgb) for rgb in colours]
+    lut = list(range(256))
+    counts = list(counts)
+    for i in range(len(colours)):
+        if counts[i] and counts[i] < enough:
+            nearest = min(common, key=lambda j: math.dist(labs[i], labs[j]))
+            if math.dist(labs[i], labs[nearest]) <= distance:
+                lut[i] = nearest
+                counts[nearest] += counts[i]
+                counts[i] = 0
+    if lut == list(range(256)):
+        return image, counts  # nothing close enough
+    with stats.timed("merge"):
+        return image.point(lut), counts
+
+
+def pixelColour(image, xy):
+    """
+    Get the #rrggbb string of the colour of the pixel at xy.
+    """
+    return hexColour(paletteColours(image)[image.getpixel(xy)])
+
+
+def colourIndex(image, colour):
+    """
+    Get the palette index of colour (any form ImageColor knows),
+    adding it to the palette of image if it is not already there.
+    """
+    rgb = ImageColor.getrgb(colour)[0:3]
+    colours = paletteColours(image)
+    if rgb in colours:
+        return colours.index(rgb)
+    if len(colours) < 256:  # room to add it
+        index = len(colours)
+        colours.append(rgb)
+    else:  # re-use an entry no pixel uses, or failing that the nearest
+        counts = image.histogram()
+        if 0 in counts:
+            index = counts.index(0)
+        else:
+            index = min(range(256),
+                        key=lambda i: sum((a - b) ** 2
+                                          for a, b in zip(colours[i], rgb)))
+        colours[index] = rgb
+    image.putpalette([value for entry in colours for value in entry])
+    return index
+
+
+def replaceColour(image, old, new):
+    """
+    Replace colour old with colour new (any forms ImageColor knows)
+    everywhere in image.
+
+    If new isn't already in the palette only the palette changes,
+    otherwise the pixels of old are remapped in one pass.
+    Returns (box, before): the box that changed (or None if nothing
+    did) and a copy of it from before (or None if only the palette
+    changed).
+    """
+    was = ImageColor.getrgb(old)[0:3]
+    rgb = ImageColor.getrgb(new)[0:3]
+    colours = paletteColours(image)
+    indexes = [i for i, colour in enumerate(colours) if colour == was]
+    if not indexes or was == rgb:
+        return None, None
+    if rgb not in colours:  # just give old's entries the new colour
+        for index in indexes:
+            colours[index] = rgb
+        image.putpalette([value for entry in colours for value in entry])
+        return (0, 0, image.width, image.height), None
+    lut = list(range(256))
+    for index in indexes:
+        lut[index] = colours.index(rgb)
+    box = image.point([255 if lut[i] != i else 0 for i in range(256)],
+                      "L").getbbox()
+    if box is None:
+        return None, None  # no pixels of that colour
+    before = image.crop(box)
+    image.paste(before.point(lut), box)
+    return box, before
+
+
+def fixDelta(image, granularity):
+    """
+    Get the half width of a fix blob on image, granularity
+    being the blob size as a fraction of the picture.
+    """
+    return int(min(image.size) * granularity / 2)
+
+
+def fixBox(image, xy, delta):
+    """
+    Get the box on image covered by a fix blob at xy.
+    """
+    x, y = xy
+    return (max(0, x - delta), max(0, y - delta),
+            min(image.width, x + delta + 1), min(image.height, y + delta + 1))
+
+
+def fixBlob(image, xy, delta, value):
+    """
+    Draw a square blob of palette index value centred on xy,
+    returning the box it covers.
+    """
+    x, y = xy
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((x - delta, y - delta, x + delta, y + delta), fill=value)
+    return fixBox(image, xy, delta)
+
+
+def _shifted(values, radius, axis, combine, edge):
+    # combine values with itself shifted up to radius either way along axis
+    result = values.copy()
+    padded = numpy.pad(values, [(radius, radius) if a == axis else (0, 0)
+                                for a in range(2)], constant_values=edge)
+    length = values.shape[axis]
+    for shift in range(2 * radius + 1):
+        if shift != radius:
+            combine(result, padded.take(range(shift, shift + length), axis=axis),
+                    out=result)
+    return result
+
+
+def _close(mask, size):
+    # grow then shrink the 255s of an "L" mask by a size square
+    if numpy is None:
+        return mask.filter(ImageFilter.MaxFilter(size)).filter(
+            ImageFilter.MinFilter(size))
+    radius = size // 2
+    values = numpy.asarray(mask) > 0
+    for axis in (0, 1):  # a square is a row then a column
+        values = _shifted(values, radius, axis, numpy.logical_or, False)
+    for axis in (0, 1):
+        values = _shifted(values, radius, axis, numpy.logical_and, True)
+    return Image.fromarray(values.astype(numpy.uint8) * 255, "L")
+
+
+def brushLine(image, points, delta, value):
+    """
+    Draw a line of palette index value, 2 * delta + 1 wide with round
+    ends, through points, returning the box it covers.
+    """
+    draw = ImageDraw.Draw(image)
+    if len(points) > 1:
+        draw.line(points, fill=value, width=2 * delta + 1, joint="curve")
+    for x, y in (points[0], points[-1]):
+        draw.ellipse((x - delta, y - delta, x + delta, y + delta), fill=value)
+    xs, ys = [x for x, y in points], [y for x, y in points]
+    return (max(0, min(xs) - delta - 1), max(0, min(ys) - delta - 1),
+            min(image.width, max(xs) + delta + 2),
+            min(image.height, max(ys) + delta + 2))
+
+
+def lineGaps(image, gap=3, box=None, dark=128):
+    """
+    Find the pixels that would close gaps of up to gap pixels in
+    the dark lines of image (within box, or all of it), using a
+    morphological close (grow then shrink) of the dark pixels.
+
+    Returns (box, mask, value) as FillEngine.region() does: the box
+    the new line pixels lie in, an "L" mask the size of box that is
+    255 over them and the palette index to draw them in; or
+    (None, None, 0) if there is nothing to close.
+    """
+    width, height = image.size
+    left, top, right, bottom = box or (0, 0, width, height)
+    size = 2 * ((gap + 1) // 2) + 1  # odd filter size that spans the gap
+    # work on a margin round box so its edges close as well as the middle
+    window = (max(0, left - size), max(0, top - size),
+              min(width, right + size), min(height, bottom + size))
+    part = image.crop(window)
+    lut = [255 if sum(rgb) < 3 * dark else 0 for rgb in paletteColours(image)]
+    lines = part.point(lut + [0] * (256 - len(lut)), "L")
+    counts = part.histogram(mask=lines)
+    if not any(counts):
+        return None, None, 0  # no lines at all
+    value = counts.index(max(counts))  # the commonest line colour
+    added = ImageChops.subtract(_close(lines, size), lines)
+    # only inside box, where the close had the whole neighbourhood
+    inner = (left - window[0], top - window[1],
+             right - window[0], bottom - window[1])
+    added = added.crop(inner)
+    found = added.getbbox()
+    if found is None:
+        return None, None, 0
+    return ((left + found[0], top + found[1], left + found[2], top + found[3]),
+            added.crop(found), value)
+
+
+def closeGaps(image, gap=3, box=None):
+    """
+    Close gaps of up to gap pixels in the dark lines of image
+    (within box, or all of it), returning the box changed or None.
+    """
+    with stats.timed("close gaps"):
+        box, mask, value = lineGaps(image, gap, box)
+        if box:
+            image.paste(value, box, mask)
+    return box
+
+
+def applyOperation(image, operation, granularity=2 / 1000):
+    """
+    Apply one operation to image, where operation is one of
+        ("fill", x, y, colour, tolerance)
+        ("gapfill", x, y, colour, tolerance, gap)
+        ("fix", x, y, colour)
+        ("brush", lines, colour)  where lines is a list of lists of points
+        ("replace", old colour, new colour)
+        ("adjust", gap[, box])
+    Returns the picture.
+    """
+    name = operation[0]
+    if name == "fill":
+        x, y, colour, tolerance = operation[1:]
+        fill(image, (x, y), colourIndex(image, colour), tolerance=tolerance)
+    elif name == "gapfill":
+        x, y, colour, tolerance, gap = operation[1:]
+        value = colourIndex(image, colour)
+        box, mask, count = gapRegion(image, (x, y), gap, tolerance)
+        if box:
+            image.paste(value, box, mask)
+    elif name == "fix":
+        x, y, colour = operation[1:]
+        fixBlob(image, (x, y), fixDelta(image, granularity),
+                colourIndex(image, colour))
+    elif name == "brush":
+        lines, colour = operation[1:]
+        value = colourIndex(image, colour)
+        for points in lines:
+            brushLine(image, [tuple(point) for point in points],
+                      fixDelta(image, granularity), value)
+    elif name == "replace":
+        replaceColour(image, *operation[1:])
+    elif name == "adjust":
+        closeGaps(image, *operation[1:])
+    else:
+        raise ValueError("Unknown operation: " + str(name))
+    return image
@@ -0,0 +1,199 @@
+"""
+A journal of the operations done to a picture, for getting them back.
+
+Each fill, fix and adjust is appended to <picture>.journal as a line
+of JSON as it is done, so a crash loses at most the operation in hand.
+Undo and redo are kept as the (compressed) pixels they restored, or
+just the palette if that's all they changed, as what they undo may be
+from before the last checkpoint.
+
+The first line says how the picture was loaded, so replaying the
+journal on to a fresh load of it gets back to where things were.
+Every so often the picture is saved as <picture>.checkpoint.png and
+the journal started again from that.
+"""
+import base64
+import json
+import os
+import zlib
+
+from PIL import Image
+
+from PadImage import analyseImage, applyOperation
+from PadStats import stats
+
+
+class PadJournal:
+    """
+    The journal (and checkpoint) kept for one picture file.
+    Nothing is written until there is something to keep.
+    """
+
+    compactEvery = 200  # operations between checkpoints
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.journal = filename + ".journal"
+        self.checkpoint = filename + ".checkpoint.png"
+        self.count = 0  # operations since the start or the checkpoint
+        self._file = None
+        self._header = None  # to write when the journal is next opened
+        self._failed = False  # can't write there, so no journal
+        return
+
+    def exists(self):
+        """
+        Is there unsaved work in the journal to replay?
+        """
+        try:
+            with open(self.journal) as file:
+                header = json.loads(file.readline())
+                more = file.readline() != ""
+        except (OSError, ValueError):
+            return False
+        return more or (header.get("checkpoint") and not header.get("saved"))
+
+    def start(self, settings):
+        """
+        Start a fresh journal for the picture loaded with settings,
+        a dict of analyseImage() arguments.
+        """
+        self.close()
+        self._remove(self.journal)
+        self._remove(self.checkpoint)
+        self._header = dict(settings, checkpoint=False)
+        self._failed = False
+        self.count = 0
+        return
+
+    def _write(self, entry):
+        if self._failed:
+            return
+        try:
+            if self._file is None:
+                self._file = open(self.journal, "a" if self._header is None
+                                  else "w")
+                if self._header is not None:
+                    self._file.write(json.dumps(self._header) + "\n")
+                    self._header = None
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+        except OSError:
+            self.close()
+            self._failed = True
+        return
+
+    def record(self, operation):
+        """
+        Add an operation (as for applyOperation()) to the journal.
+        Returns True once it is time to compact().
+        """
+        self._write(list(operation))
+        self.count += 1
+        return self.count >= self.compactEvery
+
+    def restored(self, image, box):
+        """
+        Add the pixels (and palette) of box of image, as left by an
+        undo or redo, to the journal.  Returns as record() does.
+        """
+        pixels = zlib.compress(image.crop(box).tobytes(), 1)
+        return self.record(("restore", list(box), image.getpalette(),
+                            base64.b64encode(pixels).decode("ascii")))
+
+    def recoloured(self, palette):
+        """
+        Add a palette, as left by an undo or redo that changed only
+        the palette, to the journal.  Returns as record() does.
+        """
+        return self.record(("palette", palette))
+
+    @staticmethod
+    def _restore(image, box, palette, pixels):
+        box = tuple(box)
+        part = Image.frombytes("P", (box[2] - box[0], box[3] - box[1]),
+                               zlib.decompress(base64.b64decode(pixels)))
+        image.paste(part, box)
+        image.putpalette(palette)
+        return image
+
+    def replay(self):
+        """
+        Load the picture and apply the journal to it, returning
+        the picture and the settings it was loaded with.
+        """
+        with open(self.journal) as file:
+            header = json.loads(file.readline())
+            operations = []
+            for line in file:
+                try:
+                    operations.append(tuple(json.loads(line)))
+                except ValueError:
+                    break  # cut short by a crash
+        with stats.timed("replay"):
+            if header.get("checkpoint"):
+                image = Image.open(self.checkpoint)
+                image.load()
+            else:
+                image, counts = analyseImage(self.filename,
+                                             header.get("maxPixels", 0),
+                                             header.get("distance", 0))
+            for operation in operations:
+                if operation[0] == "restore":
+                    image = self._restore(image, *operation[1:])
+                elif operation[0] == "palette":
+                    image.putpalette(operation[1])
+                else:
+                    image = applyOperation(image, operation)
+        # carry on from here
+        self.close()
+        self._header = None
+        self._failed = False
+        self.count = len(operations)
+        return image, header
+
+    def compact(self, image, settings, saved=False):
+        """
+        Save image as the checkpoint and start the journal again from it,
+        saved saying whether image is also saved somewhere.
+        """
+        if self._failed:
+            return
+        temp = self.checkpoint + ".tmp"
+        try:
+            with stats.timed("checkpoint"):
+                image.save(temp, "PNG", compress_level=1)
+            os.replace(temp, self.checkpoint)
+            self.close()
+            with open(self.journal, "w") as file:
+                file.write(json.dumps(dict(settings, checkpoint=True,
+                                           saved=saved)) + "\n")
+        except OSError:
+            self.close()
+            self._failed = True
+        self._header = None
+        self.count = 0
+        return
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return
+
+    def discard(self):
+        """
+        Forget the journal and checkpoint.
+        """
+        self.close()
+        self._remove(self.journal)
+        self._remove(self.checkpoint)
+        return
+
+    @staticmethod
+    def _remove(filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+        return
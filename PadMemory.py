@@ -0,0 +1,74 @@
+"""
+Keeps the memory used by the colouring pad within a budget.
+"""
+from PadStats import stats
+
+
+class PadMemory:
+    """
+    An account of the memory held by each part of the pad.
+
+    Each part registers how to find the bytes it holds and, if it
+    can give some up, how to spill them (to disk or by dropping what
+    can be made again).  Parts are registered coldest first, so when
+    check() finds more than high of the budget in use it asks them in
+    that order until the total is back down to low of the budget.
+    """
+
+    high = 0.9  # of the budget, start spilling
+    low = 0.75  # of the budget, spill down to
+
+    def __init__(self, budget=1024 * 1024 * 1024):
+        self.budget = budget
+        self._parts = []  # (name, used, spill) coldest first
+        self.spilled = 0  # bytes spilled so far
+        return
+
+    def register(self, name, used, spill=None):
+        """
+        Add a part called name, where used() gets the bytes it holds
+        and spill(bytes) frees about that many, returning the bytes freed.
+        """
+        self._parts.append((name, used, spill))
+        return
+
+    def usage(self):
+        """
+        Get a list of (name, bytes) for each part.
+        """
+        return [(name, used()) for name, used, spill in self._parts]
+
+    def used(self):
+        return sum(used for name, used in self.usage())
+
+    def check(self):
+        """
+        Spill the coldest parts if more than high of the budget is used,
+        returning the bytes freed.
+        """
+        total = self.used()
+        if total <= self.budget * self.high:
+            return 0
+        wanted = total - self.budget * self.low
+        freed = 0
+        with stats.timed("spill"):
+            for name, used, spill in self._parts:
+                if freed >= wanted:
+                    break
+                if spill is not None:
+                    freed += spill(wanted - freed)
+        self.spilled += freed
+        return freed
+
+    def report(self):
+        """
+        Get the usage as a table of text.
+        """
+        megabyte = 1024 * 1024
+        lines = ["%-20s %9s" % ("memory", "MB")]
+        for name, used in self.usage():
+            lines.append("%-20s %9.1f" % (name, used / megabyte))
+        lines.append("%-20s %9.1f of %d" % ("total", self.used() / megabyte,
+                                            self.budget // megabyte))
+        lines.append("%-20s %9.1f" % ("spilled", self.spilled / megabyte))
+        return "\n".join(lines)
@@ -0,0 +1,137 @@
+"""
+Timing (and profiling) of the colouring pad's operations.
+
+Wrap anything worth knowing about in stats.timed("name") and the
+time it took is kept, along with the recent times for that name,
+so the count, median, 95th percentile and worst can be shown or
+exported.  Each time is also logged at debug level.
+"""
+import cProfile
+import io
+import json
+import logging
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+
+class PadStats:
+    """
+    Rolling statistics of how long each named operation takes,
+    with an optional cProfile capture.
+    """
+
+    recent = 200  # timings kept for each operation
+
+    def __init__(self):
+        self._times = {}  # name -> deque of recent seconds
+        self._counts = {}  # name -> number of times ever
+        self._lock = threading.Lock()  # timings come from any thread
+        self._profiler = None
+        self.profile = ""  # text of the last profile captured
+        return
+
+    @contextmanager
+    def timed(self, name):
+        """
+        Time the body of a with statement as operation name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+        return
+
+    def add(self, name, seconds):
+        with self._lock:
+            if name not in self._times:
+                self._times[name] = deque(maxlen=self.recent)
+                self._counts[name] = 0
+            self._times[name].append(seconds)
+            self._counts[name] += 1
+        log.debug("%s took %.4fs", name, seconds)
+        return
+
+    def clear(self):
+        with self._lock:
+            self._times = {}
+            self._counts = {}
+        return
+
+    @staticmethod
+    def _percentile(ordered, fraction):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def summary(self):
+        """
+        Get a dict of name to count, p50, p95 and max seconds.
+        """
+        with self._lock:
+            recent = {name: sorted(times) for name, times in self._times.items()}
+            counts = dict(self._counts)
+        return {name: {"count": counts[name],
+                       "p50": self._percentile(times, 0.5),
+                       "p95": self._percentile(times, 0.95),
+                       "max": times[-1]}
+                for name, times in sorted(recent.items())}
+
+    def report(self):
+        """
+        Get the summary as a table of text.
+        """
+        lines = ["%-20s %7s %9s %9s %9s" % ("operation", "count", "p50", "p95", "max")]
+        for name, stats in self.summary().items():
+            lines.append("%-20s %7d %8.4fs %8.4fs %8.4fs"
+                         % (name, stats["count"], stats["p50"],
+                            stats["p95"], stats["max"]))
+        if len(lines) == 1:
+            lines.append("(nothing timed yet)")
+        return "\n".join(lines)
+
+    def profiling(self):
+        return self._profiler is not None
+
+    def startProfile(self):
+        """
+        Start capturing a profile of everything run on this thread.
+        """
+        if self._profiler is None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return
+
+    def stopProfile(self, lines=30):
+        """
+        Stop capturing and return the top lines of the profile,
+        by cumulative time, as text.
+        """
+        if self._profiler is not None:
+            self._profiler.disable()
+            text = io.StringIO()
+            pstats.Stats(self._profiler, stream=text).sort_stats(
+                "cumulative").print_stats(lines)
+            self.profile = text.getvalue()
+            self._profiler = None
+        return self.profile
+
+    def export(self, filename):
+        """
+        Write the summary, the recent timings and the last profile
+        to filename as JSON.
+        """
+        with self._lock:
+            recent = {name: list(times) for name, times in self._times.items()}
+        with open(filename, "w") as file:
+            json.dump({"when": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "summary": self.summary(),
+                       "recent": recent,
+                       "profile": self.profile}, file, indent=1)
+        return
+
+
+stats = PadStats()  # the one everything shares
@@ -0,0 +1,354 @@
+"""
+A tiled, virtual-scrolling view of a picture on a canvas.
+"""
+import math
+import queue
+import threading
+from tkinter import NW
+
+from PIL import Image, ImageTk
+
+from PadStats import stats
+from ZoomCache import zoomedSize
+
+
+class PadView:
+    """
+    Shows a picture on a canvas at a given zoom, a tile at a time.
+
+    Only the tiles that can be seen (plus a margin of tileMargin tiles
+    all round) are rendered, so the cost of a redraw depends on the
+    size of the window and not on the size of the picture.
+
+    The canvas scroll callbacks are hooked, so however the view is
+    moved (scrollbars, resizing the window, ...) newly exposed tiles
+    are rendered and those well out of view are forgotten.
+
+    Tiles are taken from cache (a ZoomCache), which keeps zoomed
+    copies of the picture so that changing zoom is quick.
+
+    The pixels of each tile are cut (and zoomed and turned) by a
+    render thread, so scrolling, zooming and redisplaying after an edit
+    never hold up the window; only putting the finished tiles on the
+    canvas is done on the Tk thread, polled for every poll ms.
+
+    The view lives as long as its canvas: a new picture or zoom only
+    changes the scrollregion, and tiles no longer needed are hidden
+    and kept (up to spareTiles of them) to be pasted over and moved
+    rather than new PhotoImages and canvas items being made.
+
+    When rotated the picture is shown turned a quarter clockwise
+    (a portrait sheet fills a landscape screen) by turning each tile
+    as it is rendered, so the picture itself is never copied or turned.
+
+    Knows how to map between canvas and picture coordinates.
+    """
+
+    tileSize = 256  # display pixels each way
+    tileMargin = 1  # extra tiles rendered round the visible ones
+    spareTiles = 64  # hidden tiles kept for re-use
+    poll = 10  # ms between looking for rendered tiles
+
+    def __init__(self, canvas, hbar, vbar, cache):
+        self.canvas = canvas
+        self.cache = cache
+        self._hbar = hbar
+        self._vbar = vbar
+        self.image = None
+        self.zoom = 1.0
+        self.rotated = False  # shown a quarter turn clockwise
+        self.zoomedSize = (0, 0)  # of the zoomed picture
+        self.width, self.height = 0, 0  # of the zoomed picture as shown
+        self._tiles = {}  # (col, row) -> (PhotoImage, canvas item)
+        self._spare = {}  # (width, height) -> list of (PhotoImage, item)
+        self._pending = None  # after_idle id of the next update
+        self._generation = 0  # bumped when tiles already asked for are stale
+        self._wanted = {}  # (col, row) -> number of the render wanted
+        self._asked = 0  # renders ever asked for
+        self._requests = queue.Queue()  # renders for the thread to do
+        self._rendered = queue.Queue()  # and those it has done
+        self._polling = None  # after id of the next look for them
+        threading.Thread(target=self._render, daemon=True).start()
+        canvas.config(xscrollcommand=self._xscrolled,
+                      yscrollcommand=self._yscrolled)
+        hbar['command'] = canvas.xview
+        vbar['command'] = canvas.yview
+        return
+
+    def _xscrolled(self, first, last):
+        self._hbar.set(first, last)
+        self._schedule()
+        return
+
+    def _yscrolled(self, first, last):
+        self._vbar.set(first, last)
+        self._schedule()
+        return
+
+    def _schedule(self):
+        # coalesce a burst of scroll callbacks into one update
+        if self._pending is None:
+            self._pending = self.canvas.after_idle(self.update)
+        return
+
+    def setImage(self, image, zoom):
+        """
+        Show image at zoom (1.0 is full size).
+        """
+        self.image = image
+        self.zoom = zoom
+        self.clear()
+        if self.cache.image is not image:
+            self.cache.setImage(image)
+        if image:
+            self.zoomedSize = zoomedSize(image, zoom)
+        else:
+            self.zoomedSize = (0, 0)
+        if self.rotated:
+            self.height, self.width = self.zoomedSize
+        else:
+            self.width, self.height = self.zoomedSize
+        self.canvas.config(scrollregion=(0, 0, self.width, self.height))
+        self.update()
+        return
+
+    def clear(self):
+        """
+        Forget all the rendered tiles.
+        """
+        for photo, item in self._tiles.values():
+            self._hide(photo, item)
+        self._tiles = {}
+        self._generation += 1  # so those on the way are thrown away
+        self._wanted = {}
+        return
+
+    def _hide(self, photo, item):
+        # keep the tile to use again, if there's room
+        spare = sum(len(tiles) for tiles in self._spare.values())
+        if spare < self.spareTiles:
+            self.canvas.itemconfig(item, state="hidden")
+            self._spare.setdefault((photo.width(), photo.height()),
+                                   []).append((photo, item))
+        else:
+            self.canvas.delete(item)
+        return
+
+    def used(self):
+        """
+        Get the rough bytes held by the rendered and spare tiles.
+        """
+        tiles = list(self._tiles.values())
+        for spare in self._spare.values():
+            tiles.extend(spare)
+        return sum(photo.width() * photo.height() * 4 for photo, item in tiles)
+
+    def spill(self, wanted):
+        """
+        Throw away spare tiles until wanted bytes are freed,
+        returning the bytes freed.
+        """
+        freed = 0
+        for size in list(self._spare):
+            spare = self._spare[size]
+            while spare and freed < wanted:
+                photo, item = spare.pop()
+                self.canvas.delete(item)
+                freed += photo.width() * photo.height() * 4
+            if not spare:
+                del self._spare[size]
+        return freed
+
+    def visible(self):
+        """
+        Get the visible part of the zoomed picture as a
+        (left, top, right, bottom) box in canvas coordinates.
+        """
+        canvas = self.canvas
+        w, h = canvas.winfo_width(), canvas.winfo_height()
+        if w < 2 or h < 2:  # not mapped yet, so use requested size
+            w, h = int(canvas["width"]), int(canvas["height"])
+        left, top = canvas.canvasx(0), canvas.canvasy(0)
+        return (max(0, left), max(0, top),
+                min(self.width, left + w), min(self.height, top + h))
+
+    def _tileRange(self, margin):
+        left, top, right, bottom = self.visible()
+        size = self.tileSize
+        cols = (self.width + size - 1) // size
+        rows = (self.height + size - 1) // size
+        return (max(0, int(left // size) - margin),
+                max(0, int(top // size) - margin),
+                min(cols - 1, int(right // size) + margin),
+                min(rows - 1, int(bottom // size) + margin))
+
+    def update(self):
+        """
+        Render any tiles that are (nearly) visible and
+        drop any that are well out of view.
+        """
+        self._pending = None
+        if not self.image:
+            return
+        col0, row0, col1, row1 = self._tileRange(self.tileMargin)
+        keep0, keeprow0, keep1, keeprow1 = self._tileRange(self.tileMargin + 1)
+        for key in list(self._tiles):
+            col, row = key
+            if not (keep0 <= col <= keep1 and keeprow0 <= row <= keeprow1):
+                self._hide(*self._tiles.pop(key))
+        for key in list(self._wanted):
+            col, row = key
+            if not (keep0 <= col <= keep1 and keeprow0 <= row <= keeprow1):
+                del self._wanted[key]  # no longer worth doing
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                if (col, row) not in self._tiles \
+                        and (col, row) not in self._wanted:
+                    self._ask(col, row)
+        return
+
+    def _tileBox(self, col, row):
+        size = self.tileSize
+        left, top = col * size, row * size
+        return (left, top,
+                min(left + size, self.width), min(top + size, self.height))
+
+    def _zoomedBox(self, box):
+        # the box on the zoomed picture shown in box on the canvas
+        if not self.rotated:
+            return box
+        left, top, right, bottom = box
+        zoomedHeight = self.zoomedSize[1]
+        return (top, zoomedHeight - right, bottom, zoomedHeight - left)
+
+    def _shownBox(self, box):
+        # the box on the canvas that shows box on the zoomed picture
+        if not self.rotated:
+            return box
+        left, top, right, bottom = box
+        zoomedHeight = self.zoomedSize[1]
+        return (zoomedHeight - bottom, left, zoomedHeight - top, right)
+
+    def _tile(self, box):
+        # the part of the picture shown in box on the canvas
+        return self._cut(self.zoom, self.rotated, self._zoomedBox(box))
+
+    def _cut(self, zoom, rotated, zoomedBox):
+        tile = self.cache.tile(zoom, zoomedBox)
+        if rotated:
+            with stats.timed("rotate"):
+                tile = tile.transpose(Image.ROTATE_270)  # clockwise
+        return tile
+
+    def _ask(self, col, row):
+        # have the render thread make the tile at col, row
+        self._asked += 1
+        self._wanted[(col, row)] = self._asked
+        box = self._tileBox(col, row)
+        self._requests.put((self._generation, (col, row), self._asked,
+                            self.zoom, self.rotated, self._zoomedBox(box)))
+        if self._polling is None:
+            self._polling = self.canvas.after(self.poll, self._collect)
+        return
+
+    def _render(self):
+        # the render thread: cut each tile still wanted
+        while True:
+            generation, key, number, zoom, rotated, zoomedBox = \
+                self._requests.get()
+            if generation != self._generation \
+                    or self._wanted.get(key) != number:
+                continue  # stale before we got to it
+            try:
+                with stats.timed("tile"):
+                    tile = self._cut(zoom, rotated, zoomedBox)
+            except Exception:
+                tile = None  # the picture went as we were cutting it
+            self._rendered.put((generation, key, number, tile))
+
+    def _collect(self):
+        # put any rendered tiles that are still wanted on the canvas
+        self._polling = None
+        while True:
+            try:
+                generation, key, number, tile = self._rendered.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self._generation \
+                    or self._wanted.get(key) != number:
+                continue
+            del self._wanted[key]
+            if tile is not None:
+                self._place(key, tile)
+        if self._wanted:
+            self._polling = self.canvas.after(self.poll, self._collect)
+        return
+
+    def _place(self, key, tile):
+        box = self._tileBox(*key)
+        with stats.timed("photo"):
+            if key in self._tiles:  # redrawn after an edit
+                photo, item = self._tiles[key]
+                if (photo.width(), photo.height()) == tile.size:
+                    photo.paste(tile)
+                    return
+                self._hide(*self._tiles.pop(key))
+            spare = self._spare.get(tile.size)
+            if spare:  # paste over an old one and move it here
+                photo, item = spare.pop()
+                photo.paste(tile)
+                self.canvas.coords(item, box[0], box[1])
+                self.canvas.itemconfig(item, state="normal")
+            else:
+                photo = ImageTk.PhotoImage(image=tile)
+                item = self.canvas.create_image(box[0], box[1],
+                                                image=photo, anchor=NW)
+        self._tiles[key] = (photo, item)
+        return
+
+    def refresh(self, box=None):
+        """
+        Re-render just the tiles covering box (left, top, right, bottom)
+        on the picture, or all the rendered tiles if box is None.
+        Tiles are updated in place so nothing new is created on the canvas.
+        """
+        if box is not None:
+            left, top, right, bottom = self.displayBox(box)
+        for key in list(self._tiles) + list(self._wanted):
+            tile = self._tileBox(*key)
+            if box is not None and (tile[0] >= right or tile[2] <= left
+                                    or tile[1] >= bottom or tile[3] <= top):
+                continue
+            self._ask(*key)  # again, if it was on the way
+        return
+
+    def displayBox(self, box):
+        """
+        Map a box on the picture to the box on the canvas that shows it.
+        """
+        width, height = self.zoomedSize
+        sx, sy = width / self.image.width, height / self.image.height
+        left, top, right, bottom = box
+        return self._shownBox((math.floor(left * sx), math.floor(top * sy),
+                               math.ceil(right * sx), math.ceil(bottom * sy)))
+
+    def imageBox(self, box):
+        """
+        Map a box on the canvas to the box of pixels it shows.
+        """
+        width, height = self.zoomedSize
+        sx, sy = width / self.image.width, height / self.image.height
+        left, top, right, bottom = self._zoomedBox(box)
+        return (max(0, math.floor(left / sx)), max(0, math.floor(top / sy)),
+                min(self.image.width, math.ceil(right / sx)),
+                min(self.image.height, math.ceil(bottom / sy)))
+
+    def imagePoint(self, x, y):
+        """
+        Map a point on the canvas to a pixel in the picture.
+        """
+        if self.rotated:
+            x, y = y, self.zoomedSize[1] - 1 - x
+        width, height = self.zoomedSize
+        return (int(x * self.image.width / width),
+                int(y * self.image.height / height))
@@ -0,0 +1,149 @@
+"""
+Running slow jobs away from the tkinter thread.
+"""
+import queue
+import threading
+
+from PadStats import stats
+
+
+class Cancelled(Exception):
+    """
+    Raised inside a job that has been cancelled.
+    """
+
+
+class PadJob:
+    """
+    A piece of work for the worker.
+
+    work(job) is run on the worker thread and should call job.check()
+    every so often, which raises Cancelled once the job is cancelled.
+    done(result) or failed(exception) are then called on the
+    tkinter thread.  Anything work passes to job.report() on the way
+    is handed to progress(value) on the tkinter thread, in order.
+    """
+
+    def __init__(self, work, done=None, failed=None, name="job",
+                 progress=None):
+        self.work = work
+        self.done = done
+        self.failed = failed
+        self.name = name
+        self.progress = progress
+        self._cancelled = threading.Event()
+        self._reports = queue.Queue()
+        return
+
+    def report(self, value):
+        if self.progress is not None:
+            self._reports.put(value)
+        return
+
+    def _reported(self):
+        # on the tkinter thread, pass on what's been reported so far
+        while True:
+            try:
+                value = self._reports.get_nowait()
+            except queue.Empty:
+                return
+            if not self.cancelled():
+                self.progress(value)
+
+    def cancel(self):
+        self._cancelled.set()
+        return
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self._cancelled.is_set():
+            raise Cancelled(self.name)
+        return
+
+
+class PadWorker:
+    """
+    Runs one job at a time on a background thread.
+
+    Results are handed back on the tkinter thread by polling with
+    widget.after(), so only the tkinter thread ever touches tkinter.
+    busy(flag) is called when the worker starts or stops being busy
+    and idle() after each job is finished with, so the next piece of
+    work can be started.
+    """
+
+    poll = 25  # ms between looking for results
+
+    def __init__(self, widget, busy=None, idle=None):
+        self.widget = widget
+        self._busyChanged = busy
+        self._idle = idle
+        self._job = None  # the job in hand, if any
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        return
+
+    def busy(self):
+        return self._job is not None
+
+    def submit(self, work, done=None, failed=None, name="job", progress=None):
+        """
+        Start work(job) on the worker thread (see PadJob),
+        returning the job.  Only one job runs at a time.
+        """
+        if self._job is not None:
+            raise RuntimeError("Worker is busy with " + self._job.name)
+        job = PadJob(work, done, failed, name, progress)
+        self._job = job
+        if self._busyChanged:
+            self._busyChanged(True)
+        self._jobs.put(job)
+        self.widget.after(self.poll, self._poll)
+        return job
+
+    def cancel(self):
+        """
+        Cancel the job in hand, if any.
+        """
+        if self._job is not None:
+            self._job.cancel()
+        return
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                with stats.timed(job.name):
+                    result = job.work(job)
+                self._results.put((job, True, result))
+            except Exception as e:
+                self._results.put((job, False, e))
+
+    def _poll(self):
+        if self._job is not None:
+            self._job._reported()
+        try:
+            job, ok, result = self._results.get_nowait()
+        except queue.Empty:
+            self.widget.after(self.poll, self._poll)
+            return
+        job._reported()  # anything reported since we last looked
+        self._job = None
+        if self._busyChanged:
+            self._busyChanged(False)
+        if job.cancelled() or isinstance(result, Cancelled):
+            pass  # nobody wants to know
+        elif ok:
+            if job.done:
+                job.done(result)
+        elif job.failed:
+            job.failed(result)
+        else:
+            raise result
+        if self._idle:
+            self._idle()
+        return
@@ -0,0 +1,378 @@
+"""
+A map of the connected areas of a palette picture.
+
+Outlines don't change much, so rather than searching for the area to
+fill on every click, each area of one colour is labelled once (in the
+background) and filling becomes recolouring the pixels of one label.
+Needs numpy; without it the map is never ready and fills fall back to
+FillEngine.
+"""
+import threading
+
+from PIL import Image
+
+try:
+    import numpy
+except ImportError:  # no map then
+    numpy = None
+
+
+def _runs(values):
+    # split each row in to runs of equal values, giving the row, start and
+    # end of each run (row by row) and the run number of each pixel
+    height, width = values.shape
+    change = numpy.ones((height, width), dtype=bool)
+    change[:, 1:] = values[:, 1:] != values[:, :-1]
+    rows, starts = numpy.nonzero(change)
+    ends = numpy.empty_like(starts)
+    ends[:-1] = starts[1:]
+    ends[-1] = width
+    ends[numpy.append(rows[1:] != rows[:-1], True)] = width
+    runs = numpy.cumsum(change.ravel(), dtype=numpy.int32).reshape(height, width)
+    runs -= 1
+    return rows, starts, ends, runs
+
+
+def _join(count, a, b):
+    # label the connected groups of count nodes joined by the pairs a, b
+    parent = numpy.arange(count)
+    while len(a):
+        ra, rb = parent[a], parent[b]
+        differ = ra != rb
+        a, b, ra, rb = a[differ], b[differ], ra[differ], rb[differ]
+        if not len(a):
+            break
+        # hook the higher root of each pair on to the lower one ...
+        numpy.minimum.at(parent, numpy.maximum(ra, rb), numpy.minimum(ra, rb))
+        # ... and then point everything straight at its root
+        while True:
+            grand = parent[parent]
+            if (grand == parent).all():
+                break
+            parent = grand
+    return parent
+
+
+def label(values):
+    """
+    Label the 4-connected areas of equal value in a 2d array.
+
+    Returns (labels, boxes, colours): an int32 array of the area
+    number of each pixel, and for each area its
+    (left, top, right, bottom) box and its value.
+    """
+    height, width = values.shape
+    rows, starts, ends, runs = _runs(values)
+    colour = values[rows, starts]
+    # each run (but those on the bottom row) touches the runs below it
+    # that cover its first to its last pixel
+    above = numpy.flatnonzero(rows < height - 1)
+    first = runs[rows[above] + 1, starts[above]]
+    last = runs[rows[above] + 1, ends[above] - 1]
+    touching = last - first + 1
+    a = numpy.repeat(above, touching)
+    step = numpy.arange(len(a)) - numpy.repeat(numpy.cumsum(touching) - touching, touching)
+    b = numpy.repeat(first, touching) + step
+    same = colour[a] == colour[b]
+    roots = _join(len(rows), a[same], b[same])
+    roots, area = numpy.unique(roots, return_inverse=True)
+    count = len(roots)
+    boxes = numpy.empty((count, 4), dtype=numpy.int64)
+    boxes[:, 0:2] = max(width, height)
+    boxes[:, 2:4] = 0
+    numpy.minimum.at(boxes[:, 0], area, starts)
+    numpy.minimum.at(boxes[:, 1], area, rows)
+    numpy.maximum.at(boxes[:, 2], area, ends)
+    numpy.maximum.at(boxes[:, 3], area, rows + 1)
+    colours = numpy.empty(count, dtype=colour.dtype)
+    colours[area] = colour
+    labels = area.astype(numpy.int32)[runs]
+    return labels, boxes, colours
+
+
+class RegionMap:
+    """
+    The labelled areas of a palette picture, kept up to date as it
+    is edited.
+
+    start() labels a picture in the background; until that is done
+    ready() is False and fill() returns None.  Every edit of the picture
+    must be reported with changed(), which relabels just the changed box
+    and the pixels round it, joining any areas that now meet there.
+    An area that lost pixels may have been cut in two, which only a look
+    at all of it can tell, so that is left to a thread (and the map is
+    not ready until it's done).  Boxes can be bigger than their areas
+    once edited, but region() always gives a tight one.
+    """
+
+    def __init__(self):
+        self.labels = None  # area number of each pixel
+        self.boxes = None  # (left, top, right, bottom) of each area
+        self.colours = None  # palette index of each area
+        self._ready = False
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._pending = []  # boxes changed while labelling
+        return
+
+    def used(self):
+        """
+        Get the bytes held by the map.
+        """
+        labels, boxes, colours = self.labels, self.boxes, self.colours
+        return sum(array.nbytes for array in (labels, boxes, colours)
+                   if array is not None)
+
+    def ready(self):
+        return numpy is not None and self._ready
+
+    def start(self, image):
+        """
+        Start labelling image in the background.
+        """
+        with self._lock:
+            self._ready = False
+            self._generation += 1
+            self._pending = []
+            self.labels = self.boxes = self.colours = None
+        if numpy is not None:
+            thread = threading.Thread(target=self._build,
+                                      args=(image, self._generation),
+                                      daemon=True)
+            thread.start()
+        return
+
+    def _build(self, image, generation):
+        labels, boxes, colours = label(numpy.asarray(image))
+        with self._lock:
+            if generation != self._generation:
+                return  # a different picture now
+            self.labels, self.boxes, self.colours = labels, boxes, colours
+        self._catchUp(image, generation)
+        return
+
+    def _catchUp(self, image, generation, cut=()):
+        # on the thread: look at the areas that may be cut, then
+        # catch up with any edits made while we were busy
+        if len(cut):
+            self._relabel(image, cut)
+        while True:
+            with self._lock:
+                if generation != self._generation:
+                    return
+                pending, self._pending = self._pending, []
+                if not pending:
+                    self._ready = True
+                    return
+            # all in one box, as the pixels round each are only
+            # labelled right once the others are done
+            box = (min(box[0] for box in pending), min(box[1] for box in pending),
+                   max(box[2] for box in pending), max(box[3] for box in pending))
+            cut = self._update(image, box)
+            if len(cut):
+                self._relabel(image, cut)
+        return
+
+    def changed(self, image, box=None):
+        """
+        The picture has changed in box (left, top, right, bottom),
+        or everywhere if box is None.
+        """
+        if box is None:
+            self.start(image)
+            return
+        with self._lock:
+            if not self._ready:
+                self._pending.append(box)
+                return
+        cut = self._update(image, box)
+        if len(cut):
+            with self._lock:
+                self._ready = False
+            thread = threading.Thread(target=self._catchUp,
+                                      args=(image, self._generation, cut),
+                                      daemon=True)
+            thread.start()
+        return
+
+    def _update(self, image, box):
+        # relabel box and the pixels round it, joining the areas that
+        # meet there; returns the areas that may have been cut in two
+        labels = self.labels
+        height, width = labels.shape
+        inner = (max(0, box[0]), max(0, box[1]),
+                 min(width, box[2]), min(height, box[3]))
+        if inner[0] >= inner[2] or inner[1] >= inner[3]:
+            return ()
+        left, top = max(0, inner[0] - 1), max(0, inner[1] - 1)
+        right, bottom = min(width, inner[2] + 1), min(height, inner[3] + 1)
+        window = labels[top:bottom, left:right]
+        old = window.copy()
+        values = numpy.asarray(image.crop((left, top, right, bottom)))
+        local, localBoxes, localColours = label(values)
+        ring = numpy.ones(window.shape, dtype=bool)  # pixels not changed
+        ring[inner[1] - top:inner[3] - top, inner[0] - left:inner[2] - left] = False
+        # areas that lost pixels, and the unchanged areas met on the ring
+        lost = numpy.unique(old[~ring][self.colours[old[~ring]] != values[~ring]])
+        met, metIndex = numpy.unique(old[ring], return_inverse=True)
+        # join each area met with the new areas it touches on the ring
+        pairs = numpy.unique(numpy.stack((metIndex.ravel(),
+                                          local[ring] + len(met))), axis=1)
+        roots = _join(len(met) + len(localColours), pairs[0], pairs[1])
+        # the biggest area met in each group keeps its number
+        sizes = self.boxes[met]
+        sizes = (sizes[:, 2] - sizes[:, 0]) * (sizes[:, 3] - sizes[:, 1])
+        order = numpy.lexsort((-sizes, roots[:len(met)]))
+        first = numpy.ones(len(order), dtype=bool)
+        first[1:] = roots[:len(met)][order[1:]] != roots[:len(met)][order[:-1]]
+        keeper = numpy.full(len(roots), -1, dtype=numpy.int64)
+        keeper[roots[:len(met)][order[first]]] = met[order[first]]
+        number = keeper[roots]
+        # areas met that joined a bigger one take its number everywhere
+        for index in numpy.flatnonzero(number[:len(met)] != met):
+            self._renumber(met[index], number[index])
+        # new areas take the numbers of those now gone, then more
+        gone = numpy.setdiff1d(numpy.unique(old[~ring]), met)
+        new = numpy.unique(roots[len(met):][number[len(met):] < 0])
+        spare = len(new) - len(gone)
+        if spare > 0:
+            gone = numpy.concatenate((gone, numpy.arange(len(self.boxes),
+                                                         len(self.boxes) + spare)))
+            self.boxes = numpy.concatenate(
+                (self.boxes, numpy.zeros((spare, 4), dtype=self.boxes.dtype)))
+            self.colours = numpy.concatenate(
+                (self.colours, numpy.zeros(spare, dtype=self.colours.dtype)))
+        self.boxes[gone[len(new):]] = 0  # no longer used
+        keeper[new] = gone[:len(new)]
+        self.boxes[gone[:len(new)]] = (width, height, 0, 0)
+        number = keeper[roots]
+        # label the changed pixels and grow the boxes to hold them
+        numbers = number[len(met):]
+        window[~ring] = numbers[local[~ring]]
+        numpy.minimum.at(self.boxes[:, 0], numbers, localBoxes[:, 0] + left)
+        numpy.minimum.at(self.boxes[:, 1], numbers, localBoxes[:, 1] + top)
+        numpy.maximum.at(self.boxes[:, 2], numbers, localBoxes[:, 2] + left)
+        numpy.maximum.at(self.boxes[:, 3], numbers, localBoxes[:, 3] + top)
+        self.colours[numbers] = localColours
+        # an area that lost pixels is only sure to be whole if all of
+        # it on the ring is still joined up inside the window
+        cut = []
+        for area in numpy.intersect1d(lost, met):
+            if len(numpy.unique(local[ring & (old == area)])) > 1:
+                cut.append(number[numpy.searchsorted(met, area)])
+        return numpy.unique(numpy.array(cut, dtype=numpy.int64))
+
+    def _renumber(self, old, new):
+        # area old is part of area new now
+        left, top, right, bottom = (int(v) for v in self.boxes[old])
+        part = self.labels[top:bottom, left:right]
+        part[part == old] = new
+        joined = self.boxes[new]
+        joined[0:2] = numpy.minimum(joined[0:2], self.boxes[old][0:2])
+        joined[2:4] = numpy.maximum(joined[2:4], self.boxes[old][2:4])
+        self.boxes[old] = 0  # no longer used
+        return
+
+    def _relabel(self, image, affected):
+        # label every pixel of the affected areas again, from scratch
+        labels = self.labels
+        boxes = self.boxes[affected]
+        left, top = boxes[:, 0].min(), boxes[:, 1].min()
+        right, bottom = boxes[:, 2].max(), boxes[:, 3].max()
+        window = labels[top:bottom, left:right]
+        inside = numpy.isin(window, affected)
+        values = numpy.asarray(image.crop((left, top, right, bottom))).astype(numpy.int16)
+        values[~inside] = -1  # other areas are left alone
+        local, localBoxes, localColours = label(values)
+        keep = numpy.flatnonzero(localColours >= 0)
+        # re-use the old area numbers, adding more if there are more areas
+        spare = len(keep) - len(affected)
+        if spare > 0:
+            extra = numpy.arange(len(self.boxes), len(self.boxes) + spare)
+            self.boxes = numpy.concatenate((self.boxes, numpy.zeros((spare, 4), dtype=self.boxes.dtype)))
+            self.colours = numpy.concatenate((self.colours, numpy.zeros(spare, dtype=self.colours.dtype)))
+            numbers = numpy.concatenate((affected, extra))
+        else:
+            numbers = affected[:len(keep)]
+            self.boxes[affected[len(keep):]] = 0  # no longer used
+        renumber = numpy.zeros(len(localColours), dtype=numpy.int32)
+        renumber[keep] = numbers
+        window[inside] = renumber[local[inside]]
+        self.boxes[numbers] = localBoxes[keep] + (left, top, left, top)
+        self.colours[numbers] = localColours[keep]
+        return
+
+    def region(self, xy):
+        """
+        Find the area at xy, as FillEngine.region() does,
+        or return None if the map is not ready.
+        """
+        if not self.ready():
+            return None
+        x, y = xy
+        labels = self.labels
+        height, width = labels.shape
+        if not (0 <= x < width and 0 <= y < height):
+            return None, None, 0
+        number = labels[y, x]
+        left, top, right, bottom = (int(v) for v in self.boxes[number])
+        inside = labels[top:bottom, left:right] == number
+        rows = numpy.flatnonzero(inside.any(axis=1))
+        cols = numpy.flatnonzero(inside.any(axis=0))
+        inside = inside[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        left, top = left + int(cols[0]), top + int(rows[0])
+        right, bottom = left + inside.shape[1], top + inside.shape[0]
+        mask = Image.fromarray(inside.astype(numpy.uint8) * 255)
+        return (left, top, right, bottom), mask, int(inside.sum())
+
+    def filled(self, xy, value):
+        """
+        The area at xy (as found by region()) has been filled with
+        palette index value, so there is no need to call changed().
+        """
+        number = self.labels[xy[1], xy[0]]
+        self._merge(number, tuple(int(v) for v in self.boxes[number]), value)
+        return
+
+    def fill(self, image, xy, value):
+        """
+        Fill the area of image at xy with palette index value.
+
+        Returns (box, count) as FillEngine.fill(), or None if the
+        map is not ready.  Keeps the map up to date itself, so there
+        is no need to call changed().
+        """
+        found = self.region(xy)
+        if found is None:
+            return None
+        box, mask, count = found
+        if box is not None:
+            image.paste(value, box, mask)
+            self.filled(xy, value)
+        return box, count
+
+    def _merge(self, number, box, value):
+        # area number is now colour value, so join any neighbours that match
+        labels = self.labels
+        height, width = labels.shape
+        left, top, right, bottom = (max(0, box[0] - 1), max(0, box[1] - 1),
+                                    min(width, box[2] + 1), min(height, box[3] + 1))
+        window = labels[top:bottom, left:right]
+        inside = window == number
+        edge = inside.copy()
+        edge[1:] |= inside[:-1]
+        edge[:-1] |= inside[1:]
+        edge[:, 1:] |= inside[:, :-1]
+        edge[:, :-1] |= inside[:, 1:]
+        neighbours = numpy.unique(window[edge & ~inside])
+        joined = self.boxes[number].copy()
+        for other in neighbours[self.colours[neighbours] == value]:
+            oleft, otop, oright, obottom = (int(v) for v in self.boxes[other])
+            part = labels[otop:obottom, oleft:oright]
+            part[part == other] = number
+            joined[0:2] = numpy.minimum(joined[0:2], self.boxes[other][0:2])
+            joined[2:4] = numpy.maximum(joined[2:4], self.boxes[other][2:4])
+            self.boxes[other] = 0  # no longer used
+        self.boxes[number] = joined
+        self.colours[number] = value
+        return
@@ -0,0 +1,213 @@
+"""
+Undo and redo for a palette picture, kept within a memory budget.
+"""
+import os
+import tempfile
+import zlib
+
+from PIL import Image
+
+
+class Patch:
+    """
+    One edit: the box it changed, with compressed copies of
+    the pixels in the box (and the palette) before and after it.
+    """
+
+    def __init__(self, box, before, after, paletteBefore, paletteAfter):
+        self.box = box
+        self.pixels = before is not None  # or only the palette changed
+        self.spilled = None  # (file, bytes before) once out of memory
+        if self.pixels:
+            self.mode = after.mode
+            self.size = after.size
+            self.before = zlib.compress(before.tobytes(), 1)
+            self.after = zlib.compress(after.tobytes(), 1)
+        self.paletteBefore = paletteBefore
+        self.paletteAfter = paletteAfter
+        return
+
+    def bytes(self):
+        """
+        Get the bytes held in memory.
+        """
+        if not self.pixels or self.spilled:
+            return 0
+        return len(self.before) + len(self.after)
+
+    def spill(self):
+        """
+        Move the pixels out to a temporary file,
+        returning the bytes of memory freed.
+        """
+        freed = self.bytes()
+        if freed:
+            with tempfile.NamedTemporaryFile(prefix="ColouringPad-",
+                                             suffix=".undo",
+                                             delete=False) as file:
+                file.write(self.before)
+                file.write(self.after)
+            self.spilled = (file.name, len(self.before))
+            self.before = self.after = None
+        return freed
+
+    def diskBytes(self):
+        return os.path.getsize(self.spilled[0]) if self.spilled else 0
+
+    def forget(self):
+        """
+        Remove any temporary file, as the patch is no longer wanted.
+        """
+        if self.spilled:
+            try:
+                os.remove(self.spilled[0])
+            except OSError:
+                pass
+            self.spilled = None
+        return
+
+    def _data(self, undo):
+        if not self.spilled:
+            return self.before if undo else self.after
+        filename, length = self.spilled
+        with open(filename, "rb") as file:
+            data = file.read()
+        return data[:length] if undo else data[length:]
+
+    def apply(self, image, undo=True):
+        """
+        Put image back to how it was before (or after) this edit.
+        """
+        palette = self.paletteBefore if undo else self.paletteAfter
+        if self.pixels:
+            part = Image.frombytes(self.mode, self.size,
+                                   zlib.decompress(self._data(undo)))
+            image.paste(part, self.box[0:2])
+        if palette is not None and image.getpalette() != palette:
+            image.putpalette(palette)
+        return
+
+
+class UndoHistory:
+    """
+    A list of edits that can be undone, and a list of undone edits
+    that can be redone.
+
+    Each edit is kept as a Patch of just the box it changed.  Once the
+    patches in memory come to more than budget bytes the oldest are
+    spilled to temporary files, and once those come to more than
+    diskBudget bytes the oldest edits are forgotten.
+    """
+
+    def __init__(self, budget=64 * 1024 * 1024, diskBudget=1024 * 1024 * 1024):
+        self.budget = budget
+        self.diskBudget = diskBudget
+        self._undo = []
+        self._redo = []
+        return
+
+    def clear(self):
+        for patch in self._undo + self._redo:
+            patch.forget()
+        self._undo = []
+        self._redo = []
+        return
+
+    def used(self):
+        """
+        Get the bytes of memory held by the history.
+        """
+        return sum(patch.bytes() for patch in self._undo + self._redo)
+
+    def onDisk(self):
+        """
+        Get the bytes the history has spilled to disk.
+        """
+        return sum(patch.diskBytes() for patch in self._undo + self._redo)
+
+    def spill(self, wanted):
+        """
+        Spill the patches furthest from the picture as it is (the oldest
+        undo and the last redo) to disk until wanted bytes of memory
+        are freed, returning the bytes freed.
+        """
+        # _undo is oldest first and _redo last to redo first
+        far = [(len(self._undo) - i, patch) for i, patch in enumerate(self._undo)]
+        far += [(len(self._redo) - i, patch) for i, patch in enumerate(self._redo)]
+        far.sort(key=lambda pair: -pair[0])
+        freed = 0
+        for distance, patch in far:
+            if freed >= wanted:
+                break
+            freed += patch.spill()
+        return freed
+
+    def canUndo(self):
+        return len(self._undo) > 0
+
+    def canRedo(self):
+        return len(self._redo) > 0
+
+    def nextBox(self, redo=False):
+        """
+        Get the box of pixels the next undo (or redo) will change,
+        or None if there is nothing to undo (or redo) or it only
+        changes the palette.
+        """
+        patches = self._redo if redo else self._undo
+        if not patches or not patches[-1].pixels:
+            return None
+        return patches[-1].box
+
+    def paletteOnly(self, redo=False):
+        """
+        Does the next undo (or redo) only change the palette?
+        """
+        patches = self._redo if redo else self._undo
+        return bool(patches) and not patches[-1].pixels
+
+    def record(self, image, box, before, palette=None):
+        """
+        Record an edit of image that changed box, given before,
+        a copy of box before the edit (or None if only the palette
+        changed), and the palette before it.
+        """
+        after = image.crop(box) if before is not None else None
+        patch = Patch(box, before, after, palette, image.getpalette())
+        self._undo.append(patch)
+        for patch in self._redo:
+            patch.forget()
+        self._redo = []
+        used = self.used()
+        if used > self.budget:
+            self.spill(used - self.budget)
+        onDisk = self.onDisk()
+        while onDisk > self.diskBudget and len(self._undo) > 1:
+            patch = self._undo.pop(0)
+            onDisk -= patch.diskBytes()
+            patch.forget()
+        return
+
+    def undo(self, image):
+        """
+        Undo the last edit of image, returning the box it changed,
+        or None if there was nothing to undo.
+        """
+        if not self._undo:
+            return None
+        patch = self._undo.pop()
+        patch.apply(image, undo=True)
+        self._redo.append(patch)
+        return patch.box
+
+    def redo(self, image):
+        """
+        Redo the last undone edit of image, returning the box it changed,
+        or None if there was nothing to redo.
+        """
+        if not self._redo:
+            return None
+        patch = self._redo.pop()
+        patch.apply(image, undo=False)
+        self._undo.append(patch)
+        return patch.box
@@ -0,0 +1,330 @@
+"""
+A cache of zoomed copies of a picture, kept within a memory budget.
+"""
+import math
+import os
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+
+from PIL import Image
+
+from PadStats import stats
+
+
+def zoomedSize(image, zoom):
+    """
+    Get the size of image when shown at zoom (1.0 is full size).
+    """
+    return max(1, int(image.width * zoom)), max(1, int(image.height * zoom))
+
+
+def sourceBox(image, size, box):
+    """
+    Map box on a copy of image zoomed to size back on to image.
+    """
+    sx, sy = size[0] / image.width, size[1] / image.height
+    left, top, right, bottom = box
+    return (left / sx, top / sy, right / sx, bottom / sy)
+
+
+class ZoomCache:
+    """
+    A lazily built pyramid of zoomed copies of a picture.
+
+    Each zoom asked for is built in the background the first time
+    it is wanted and, until it is ready, tiles are rendered straight
+    from the picture.  Built levels are kept in least recently used
+    order and the oldest are dropped to stay within budget bytes.
+
+    When the picture is edited, call changed() with the box that
+    changed so that each level is patched (or, for big changes,
+    dropped to be rebuilt when next wanted).
+
+    Levels can be spilled to temporary files to free memory and are
+    read back, and caught up with any edits since, when next wanted.
+    The files are written by a thread, and a level wanted again before
+    it is written is simply kept.
+    """
+
+    dropFraction = 0.25  # of the picture changed, drop rather than patch
+
+    def __init__(self, budget=256 * 1024 * 1024):
+        self.budget = budget
+        self.image = None
+        self._levels = OrderedDict()  # zoom -> zoomed image
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped for each new picture
+        self._building = None  # zoom being built
+        self._wanted = None  # zoom to build next
+        self._pending = []  # boxes changed while building
+        self._spilled = {}  # zoom -> (file, size, mode, boxes changed since)
+        self._writing = {}  # zoom -> (level, boxes changed since) being spilled
+        return
+
+    def setImage(self, image):
+        """
+        Forget all levels and start caching image.
+        """
+        with self._lock:
+            self.image = image
+            self._levels.clear()
+            self._forget()
+            self._generation += 1
+            self._wanted = None
+            self._pending = []
+        return
+
+    def cancel(self):
+        """
+        Give up on any level being (or waiting to be) built.
+        """
+        with self._lock:
+            self._wanted = None
+            if self._building is not None:
+                self._generation += 1  # so its result is thrown away
+        return
+
+    def used(self):
+        """
+        Get the bytes held by the cached levels.
+        """
+        return sum(self._bytes(level) for level in self._levels.values())
+
+    def onDisk(self):
+        """
+        Get the bytes of the levels spilled to disk.
+        """
+        total = 0
+        for filename, size, mode, boxes in list(self._spilled.values()):
+            try:
+                total += os.path.getsize(filename)
+            except OSError:
+                pass
+        return total
+
+    def spill(self, wanted):
+        """
+        Spill the least recently used levels to disk until wanted
+        bytes are freed, returning the bytes freed (once written).
+        """
+        freed = 0
+        spilling = []
+        with self._lock:
+            while freed < wanted and self._levels:
+                zoom, level = self._levels.popitem(last=False)
+                boxes = []
+                self._writing[zoom] = (level, boxes)
+                spilling.append((zoom, level, boxes))
+                freed += self._bytes(level)
+        if spilling:
+            threading.Thread(target=self._write, args=(spilling,),
+                             daemon=True).start()
+        return freed
+
+    def _write(self, spilling):
+        for zoom, level, boxes in spilling:
+            try:
+                with stats.timed("zoom spill"), tempfile.NamedTemporaryFile(
+                        prefix="ColouringPad-", suffix=".zoom",
+                        delete=False) as file:
+                    file.write(zlib.compress(level.tobytes(), 1))
+                filename = file.name
+            except OSError:
+                filename = None  # so it's just dropped
+            with self._lock:
+                writing = self._writing.get(zoom)
+                if writing is not None and writing[1] is boxes:
+                    del self._writing[zoom]
+                    if filename:
+                        self._spilled[zoom] = (filename, level.size,
+                                               level.mode, boxes)
+                        filename = None
+            if filename:  # taken back or forgotten while we wrote it
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+        return
+
+    def _forget(self):
+        # must hold the lock; remove the files of spilled levels
+        for filename, size, mode, boxes in self._spilled.values():
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+        self._spilled = {}
+        self._writing = {}  # their writers remove them
+        return
+
+    @staticmethod
+    def _bytes(image):
+        return image.width * image.height * len(image.getbands())
+
+    def level(self, zoom):
+        """
+        Get the copy of the picture at zoom if it is ready,
+        otherwise start building it and return None.
+        """
+        if zoom == 1:
+            return self.image
+        with self._lock:
+            level = self._levels.get(zoom)
+            if level is not None:
+                self._levels.move_to_end(zoom)
+                return level
+            writing = self._writing.pop(zoom, None)
+            if writing is not None:  # not on disk yet, so keep it after all
+                level, boxes = writing
+                self._matchPalette(level)
+                for box in boxes:
+                    self._patch(level, box)
+                self._levels[zoom] = level
+                return level
+            if not self.image:
+                return None
+            width, height = zoomedSize(self.image, zoom)
+            if width * height * len(self.image.getbands()) > self.budget / 2:
+                return None  # too big to be worth caching
+            if self._building is None:
+                self._start(zoom)
+            elif self._building != zoom:
+                self._wanted = zoom
+        return None
+
+    def _start(self, zoom):
+        # must hold the lock
+        self._building = zoom
+        self._pending = []
+        self._writing.pop(zoom, None)  # built again, so not wanted
+        spilled = self._spilled.pop(zoom, None)
+        if spilled:
+            self._pending = spilled[3]
+        thread = threading.Thread(target=self._build,
+                                  args=(self.image, zoom, self._generation,
+                                        spilled),
+                                  daemon=True)
+        thread.start()
+        return
+
+    def _build(self, image, zoom, generation, spilled=None):
+        level = None
+        if spilled:
+            filename, size, mode, boxes = spilled
+            try:
+                with stats.timed("zoom restore"), open(filename, "rb") as file:
+                    level = Image.frombytes(mode, size,
+                                            zlib.decompress(file.read()))
+                os.remove(filename)
+            except (OSError, ValueError, zlib.error):
+                level = None
+        if level is None:
+            with stats.timed("zoom level"):
+                level = image.resize(zoomedSize(image, zoom),
+                                     resample=Image.NEAREST)
+        with self._lock:
+            self._building = None
+            if generation == self._generation:
+                # catch up with any edits made while we were busy
+                self._matchPalette(level)
+                for box in self._pending:
+                    self._patch(level, box)
+                self._pending = []
+                self._levels[zoom] = level
+                self._levels.move_to_end(zoom)
+                self._evict()
+            if self._wanted is not None:
+                zoom, self._wanted = self._wanted, None
+                if zoom not in self._levels:
+                    self._start(zoom)
+        return
+
+    def _evict(self):
+        # must hold the lock
+        used = self.used()
+        while used > self.budget and self._levels:
+            zoom, level = self._levels.popitem(last=False)
+            used -= self._bytes(level)
+        return
+
+    def _matchPalette(self, level):
+        # palette pictures share one set of colours, so keep it in step
+        if level.mode == "P":
+            palette = self.image.getpalette()
+            if level.getpalette() != palette:
+                level.putpalette(palette)
+        return
+
+    def _patch(self, level, box):
+        # redo the part of level that covers box on the picture
+        image = self.image
+        sx, sy = level.width / image.width, level.height / image.height
+        left, top, right, bottom = box
+        zoomed = (max(0, math.floor(left * sx)),
+                  max(0, math.floor(top * sy)),
+                  min(level.width, math.ceil(right * sx)),
+                  min(level.height, math.ceil(bottom * sy)))
+        if zoomed[2] <= zoomed[0] or zoomed[3] <= zoomed[1]:
+            return
+        part = image.resize((zoomed[2] - zoomed[0], zoomed[3] - zoomed[1]),
+                            resample=Image.NEAREST,
+                            box=sourceBox(image, level.size, zoomed))
+        level.paste(part, zoomed[0:2])
+        return
+
+    def changed(self, box=None):
+        """
+        The picture has changed in box (left, top, right, bottom),
+        or everywhere if box is None.
+        """
+        with self._lock:
+            image = self.image
+            if not image:
+                return
+            if box is None:
+                box = (0, 0, image.width, image.height)
+            area = (box[2] - box[0]) * (box[3] - box[1])
+            drop = area > image.width * image.height * self.dropFraction
+            if self._building is not None:
+                if drop:
+                    self._generation += 1  # don't keep what's being built
+                else:
+                    self._pending.append(box)
+            if drop:
+                self._levels.clear()
+                self._forget()
+            else:
+                for level in self._levels.values():
+                    self._matchPalette(level)
+                    self._patch(level, box)
+                for spilled in self._spilled.values():
+                    spilled[3].append(box)  # patched when read back
+                for level, boxes in self._writing.values():
+                    boxes.append(box)
+        return
+
+    def paletteChanged(self):
+        """
+        Only the palette of the picture has changed.
+        """
+        with self._lock:
+            for level in self._levels.values():
+                self._matchPalette(level)
+        return
+
+    def tile(self, zoom, box):
+        """
+        Get the part (box) of the picture shown at zoom,
+        from a cached level if there is one.
+        """
+        image = self.image
+        level = self.level(zoom)
+        if level is not None:
+            return level.crop(box)
+        size = zoomedSize(image, zoom)
+        with stats.timed("resize"):
+            return image.resize((box[2] - box[0], box[3] - box[1]),
+                                resample=Image.NEAREST,
+                                box=sourceBox(image, size, box))
@@ -0,0 +1,72 @@
+from PIL import Image, ImageDraw
+
+from ColourUsage import ColourUsage
+
+
+def _picture():
+    image = Image.new("P", (100, 50), 0)
+    image.putpalette([255, 255, 255, 0, 0, 0, 255, 0, 0, 0, 0, 0])
+    ImageDraw.Draw(image).rectangle((0, 0, 9, 49), fill=1)  # 500 black
+    return image
+
+
+def _fresh(image):
+    usage = ColourUsage()
+    usage.start(image)
+    return usage.usage()
+
+
+def test_start():
+    image = _picture()
+    usage = ColourUsage()
+    usage.start(image)
+    assert usage.usage() == {"#ffffff": 0.9, "#000000": 0.1}
+
+
+def test_changing_and_changed():
+    image = _picture()
+    usage = ColourUsage()
+    usage.start(image)
+    box = (50, 10, 70, 30)
+    usage.changing(box)
+    image.paste(2, box)
+    usage.changed(box)
+    assert usage.usage() == _fresh(image)
+    assert usage.usage()["#ff0000"] == 400 / 5000
+
+
+def test_counted():
+    image = _picture()
+    usage = ColourUsage()
+    usage.start(image)
+    box = (5, 0, 30, 50)
+    before = image.crop(box)
+    image.paste(2, box)
+    usage.counted(before, image.crop(box))
+    assert usage.usage() == _fresh(image)
+
+
+def test_new_palette_entry_and_shared_colour():
+    image = _picture()
+    palette = image.getpalette()
+    image.putpalette(palette[:12] + [0, 255, 0])  # index 4 is new
+    usage = ColourUsage()
+    usage.start(image, image.histogram()[:2])  # counts shorter than palette
+    box = (90, 0, 100, 50)
+    usage.changing(box)
+    image.paste(4, box)
+    usage.changed(box)
+    box = (80, 0, 90, 50)
+    usage.changing(box)
+    image.paste(3, box)  # black too, as index 3
+    usage.changed(box)
+    assert usage.usage() == {"#ffffff": 0.7, "#000000": 0.2, "#00ff00": 0.1}
+
+
+def test_ordered():
+    image = _picture()
+    usage = ColourUsage()
+    usage.start(image)
+    colours = ["#000000", "#ff0000", "#ffffff", "#000000"]
+    assert usage.ordered(colours) == ["#ffffff", "#000000", "#ff0000"]
+    assert usage.ordered(colours, enough=0.2) == ["#ffffff"]
@@ -0,0 +1,78 @@
+import random
+
+import pytest
+from PIL import Image, ImageChops, ImageDraw
+
+from FillEngine import numpy, region, gapRegion, fill, _outline
+
+needsNumpy = pytest.mark.skipif(numpy is None, reason="needs numpy")
+
+
+def _noisy(size, seed):
+    # a palette picture of random blobs in a few close colours
+    rand = random.Random(seed)
+    image = Image.new("P", size, 0)
+    image.putpalette([255, 255, 255, 0, 0, 0, 250, 250, 250, 200, 0, 0])
+    draw = ImageDraw.Draw(image)
+    for _ in range(60):
+        x, y = rand.randrange(size[0]), rand.randrange(size[1])
+        draw.ellipse((x, y, x + rand.randrange(2, 30), y + rand.randrange(2, 30)),
+                     fill=rand.randrange(4))
+    return image
+
+
+def _same(a, b):
+    assert a[0] == b[0]
+    assert a[2] == b[2]
+    if a[1] is not None:
+        assert ImageChops.difference(a[1], b[1]).getbbox() is None
+
+
+@needsNumpy
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("tolerance", [0, 20])
+def test_engines_agree(seed, tolerance):
+    image = _noisy((120, 90), seed)
+    rand = random.Random(seed)
+    for _ in range(10):
+        xy = (rand.randrange(120), rand.randrange(90))
+        _same(region(image, xy, tolerance, engine="pil"),
+              region(image, xy, tolerance, engine="numpy"))
+
+
+@needsNumpy
+def test_engines_agree_on_outline():
+    image = _outline((400, 400))
+    for xy in ((398, 1), (23, 23), (300, 300)):
+        _same(region(image, xy, engine="pil"), region(image, xy, engine="numpy"))
+
+
+def test_off_picture():
+    image = _outline((100, 100))
+    assert region(image, (-1, 5)) == (None, None, 0)
+    assert region(image, (5, 100)) == (None, None, 0)
+
+
+def test_fill_changes_only_the_area():
+    image = _outline((200, 200))
+    before = image.copy()
+    box, count = fill(image, (13, 13), 2)
+    changed = ImageChops.difference(image.convert("RGB"),
+                                    before.convert("RGB")).getbbox()
+    assert changed is not None and box[0] <= changed[0] and box[1] <= changed[1]
+    assert changed[2] <= box[2] and changed[3] <= box[3]
+    assert image.histogram()[2] == count
+
+
+def test_gap_fill_does_not_leak():
+    # two boxes joined by a gap of 2 pixels in the wall between them
+    image = Image.new("P", (80, 40), 0)
+    image.putpalette([255, 255, 255, 0, 0, 0])
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 79, 39), outline=1, width=2)
+    draw.line((40, 0, 40, 39), fill=1, width=2)
+    draw.line((40, 19, 40, 20), fill=0, width=2)  # the gap
+    leaky = region(image, (10, 10))[0]
+    assert leaky[2] > 41  # an ordinary fill gets through
+    box, mask, count = gapRegion(image, (10, 10), gap=4)
+    assert box[2] <= 42
@@ -0,0 +1,59 @@
+import pytest
+from PIL import Image, ImageDraw
+
+from PadBatch import parseScript, colourFile, main, _position
+
+
+def test_parse_script():
+    script = ["# white background", "", "adjust", "adjust 5",
+              "fill 0 0 white", "FILL 50% 50% #ffe0e0 32  # pink middle",
+              "fix 10 20 black"]
+    assert parseScript(script) == [
+        ("adjust", 3), ("adjust", 5),
+        ("fill", "0", "0", "white", 0),
+        ("fill", "50%", "50%", "#ffe0e0", 32),
+        ("fix", "10", "20", "black")]
+
+
+@pytest.mark.parametrize("line", ["fill 1 2", "fix 1 2 red 3", "paint 1 2 red",
+                                  "adjust 1 2", "fill 1 2 red lots"])
+def test_parse_script_errors(line):
+    with pytest.raises(ValueError, match="Line 2"):
+        parseScript(["adjust", line])
+
+
+def test_position():
+    assert _position("12", 100) == 12
+    assert _position("50%", 101) == 50
+    assert _position("100%", 80) == 79
+
+
+def test_colour_file(tmp_path):
+    source = Image.new("RGB", (60, 40), "white")
+    ImageDraw.Draw(source).rectangle((10, 10, 30, 30), outline="black", width=2)
+    filename, output = str(tmp_path / "in.png"), str(tmp_path / "out.png")
+    source.save(filename)
+    colourFile(filename, output, parseScript(["fill 20 20 red",
+                                              "fill 0 0 #0000ff"]))
+    result = Image.open(output).convert("RGB")
+    assert result.getpixel((20, 20)) == (255, 0, 0)
+    assert result.getpixel((0, 0)) == (0, 0, 255)
+    assert result.getpixel((10, 20)) == (0, 0, 0)
+
+
+def test_merge_options(tmp_path):
+    source = Image.new("RGB", (100, 100), "white")
+    ImageDraw.Draw(source).rectangle((10, 10, 40, 40), fill="black")
+    source.putpixel((70, 70), (20, 20, 20))  # rare and nearly black
+    folder = tmp_path / "in"
+    folder.mkdir()
+    source.save(str(folder / "sheet.png"))
+    script = tmp_path / "script.txt"
+    script.write_text("fill 0 0 white\n")
+    for options, speck in (([], (0, 0, 0)), (["--no-merge"], (20, 20, 20)),
+                           (["-m", "5"], (20, 20, 20))):
+        output = tmp_path / ("out%d" % len(options))
+        assert main([str(script), str(folder), "-o", str(output), "-j", "1"]
+                    + options) == 0
+        result = Image.open(str(output / "sheet.png")).convert("RGB")
+        assert result.getpixel((70, 70)) == speck
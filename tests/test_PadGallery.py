@@ -0,0 +1,28 @@
+import os
+
+from PadGallery import ThumbIndex
+
+
+def test_add_and_lookup(tmp_path):
+    index = ThumbIndex(str(tmp_path))
+    path = tmp_path / "picture.png"
+    path.write_bytes(b"not really")
+    thumb = index.target(str(path))
+    open(thumb, "wb").close()
+    index.add(str(path), thumb)
+    assert index.lookup(str(path)) == thumb
+    os.utime(path, (0, 0))  # a different version
+    assert index.lookup(str(path)) is None
+
+
+def test_add_of_a_removed_picture(tmp_path):
+    index = ThumbIndex(str(tmp_path))
+    path = tmp_path / "picture.png"
+    path.write_bytes(b"not really")
+    thumb = index.target(str(path))
+    open(thumb, "wb").close()
+    path.unlink()
+    index.add(str(path), thumb)
+    assert index.lookup(str(path)) is None
+    index.save()
+    assert not os.path.exists(index.filename)  # nothing was indexed
@@ -0,0 +1,237 @@
+import os
+
+import pytest
+from PIL import Image, ImageDraw
+
+import PadImage
+from PadImage import previewImage
+
+
+def _sheet(size=(1200, 900)):
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for x in range(0, size[0], 50):
+        draw.line((x, 0, x, size[1]), fill="black", width=3)
+    draw.ellipse((100, 100, 700, 700), outline="black", width=5, fill="red")
+    return image
+
+
+def test_preview_only_for_jpeg(tmp_path):
+    image = _sheet()
+    png, jpeg = str(tmp_path / "sheet.png"), str(tmp_path / "sheet.jpg")
+    image.save(png)
+    image.save(jpeg)
+    assert previewImage(png, (300, 200)) is None  # no cheap decode
+    preview = previewImage(jpeg, (300, 200))
+    assert preview.mode == "RGB" and preview.width <= image.width // 2
+    assert previewImage(jpeg, (1000, 800)) is None  # small enough already
+
+
+def test_png_previewed_from_its_decode(tmp_path, monkeypatch):
+    monkeypatch.setattr(PadImage, "cacheDir", str(tmp_path / "cache"))
+    png = str(tmp_path / "sheet.png")
+    _sheet().save(png)
+    previews = []
+
+    def decoded(rgb):
+        previews.append(PadImage.previewCopy(rgb, (300, 200)))
+
+    PadImage.analyseImage(png, decoded=decoded)
+    assert len(previews) == 1 and previews[0].size == (300, 225)
+    assert previews[0].mode == "RGB"
+    PadImage.analyseImage(png, decoded=previews.append)
+    assert len(previews) == 1  # cached, so nothing to wait for
+    assert PadImage.previewCopy(_sheet(), (1000, 800)) is None
+
+
+def _noisy(size=(300, 200)):
+    image = _sheet(size)
+    noise = Image.merge("RGB", [Image.effect_noise(size, 40) for _ in range(3)])
+    return Image.blend(image, noise, 0.3)
+
+
+def test_reduce_keeps_exact_colours():
+    image = _sheet()
+    reduced, counts = PadImage.reduceColours(image)
+    assert reduced.mode == "P"
+    assert counts == reduced.histogram()
+    assert sorted(reduced.convert("RGB").getcolors()) == sorted(image.getcolors())
+
+
+def test_reduce_noisy_picture(monkeypatch):
+    image = _noisy()
+    reduced, counts = PadImage.reduceColours(image, 8)
+    assert len(reduced.getpalette()) <= 8 * 3
+    assert sum(counts) == image.width * image.height
+    assert counts == reduced.histogram()
+    # the same without numpy
+    monkeypatch.setattr(PadImage, "numpy", None)
+    again, againCounts = PadImage.reduceColours(image, 8)
+    assert againCounts == counts
+    assert again.getpalette() == reduced.getpalette()
+
+
+def test_analyse_is_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(PadImage, "cacheDir", str(tmp_path / "cache"))
+    filename = str(tmp_path / "sheet.png")
+    _sheet().save(filename)
+    image, counts = PadImage.analyseImage(filename)
+    calls = []
+    monkeypatch.setattr(PadImage, "reduceColours",
+                        lambda *args: calls.append(args))
+    cached, cachedCounts = PadImage.analyseImage(filename)
+    assert not calls
+    assert cachedCounts == counts
+    assert cached.tobytes() == image.tobytes()
+
+
+def _gappy():
+    # a palette outline with a 2 pixel gap at each end of a line
+    image = Image.new("P", (120, 60), 0)
+    image.putpalette([255, 255, 255, 0, 0, 0])
+    draw = ImageDraw.Draw(image)
+    draw.line((5, 30, 55, 30), fill=1, width=3)
+    draw.line((58, 30, 115, 30), fill=1, width=3)
+    draw.line((5, 10, 15, 10), fill=1, width=3)
+    draw.line((18, 10, 40, 10), fill=1, width=3)
+    return image
+
+
+def test_close_gaps_everywhere_or_in_a_box():
+    image = _gappy()
+    everywhere = image.copy()
+    box, mask, value = PadImage.lineGaps(everywhere, 3)
+    PadImage.closeGaps(everywhere, 3)
+    assert everywhere.getpixel((56, 30)) == 1 and everywhere.getpixel((16, 10)) == 1
+    inBox = image.copy()
+    PadImage.closeGaps(inBox, 3, (40, 20, 80, 40))
+    assert inBox.getpixel((56, 30)) == 1 and inBox.getpixel((16, 10)) == 0
+
+
+def test_save_options(tmp_path):
+    image = PadImage.reduceColours(_sheet())[0]
+    indexed, full = str(tmp_path / "indexed.png"), str(tmp_path / "full.png")
+    PadImage.saveImage(image, indexed, compression=9)
+    PadImage.saveImage(image, full, compression=9, indexed=False)
+    assert Image.open(indexed).mode == "P" and Image.open(full).mode == "RGB"
+    assert Image.open(full).tobytes() == image.convert("RGB").tobytes()
+    loose = str(tmp_path / "loose.png")
+    PadImage.saveImage(image, loose, compression=0)
+    assert os.path.getsize(loose) > os.path.getsize(indexed)
+    jpeg = str(tmp_path / "sheet.jpg")
+    PadImage.saveImage(image, jpeg)
+    assert Image.open(jpeg).format == "JPEG"
+    assert sorted(os.listdir(tmp_path)) == ["full.png", "indexed.png",
+                                            "loose.png", "sheet.jpg"]
+
+
+def test_failed_save_leaves_the_old_file(tmp_path, monkeypatch):
+    filename = str(tmp_path / "sheet.png")
+    PadImage.saveImage(PadImage.reduceColours(_sheet())[0], filename)
+    with open(filename, "rb") as file:
+        old = file.read()
+
+    def broken(self, target, *args, **options):
+        with open(target, "wb") as file:
+            file.write(b"half a picture")
+        raise OSError("disk full")
+
+    monkeypatch.setattr(Image.Image, "save", broken)
+    with pytest.raises(OSError):
+        PadImage.saveImage(Image.new("P", (10, 10)), filename)
+    with open(filename, "rb") as file:
+        assert file.read() == old
+    assert os.listdir(tmp_path) == ["sheet.png"]  # no temporary file left
+
+
+def _blank():
+    image = Image.new("P", (100, 80), 0)
+    image.putpalette([255, 255, 255, 0, 0, 0, 255, 0, 0])
+    return image
+
+
+def test_brush_line_stays_in_its_box():
+    for points in ([(50, 40)], [(10, 10), (60, 30), (90, 75)], [(0, 0), (99, 79)]):
+        image = _blank()
+        box = PadImage.brushLine(image, points, 3, 2)
+        painted = image.point([0, 255, 255] + [0] * 253, "L").getbbox()
+        assert box[0] <= painted[0] and box[1] <= painted[1]
+        assert painted[2] <= box[2] and painted[3] <= box[3]
+        assert 0 <= box[0] and 0 <= box[1] and box[2] <= 100 and box[3] <= 80
+        for point in points:  # round and 7 wide at each point
+            x, y = point
+            assert image.getpixel(point) == 2
+            assert image.getpixel((min(99, x + 3), y)) == 2
+
+
+def test_brush_dot():
+    image = _blank()
+    PadImage.brushLine(image, [(50, 40)], 2, 1)
+    # a 5 wide disc, without its corners
+    assert sorted(image.crop((48, 38, 53, 43)).getcolors()) == [(4, 0), (21, 1)]
+    assert image.crop((47, 37, 54, 44)).histogram()[1] == 21
+
+
+def test_replace_with_a_new_colour_changes_only_the_palette():
+    image = _blank()
+    image.paste(1, (10, 10, 30, 20))
+    pixels = image.tobytes()
+    box, before = PadImage.replaceColour(image, "#000000", "#00ff00")
+    assert box == (0, 0, 100, 80) and before is None
+    assert image.tobytes() == pixels
+    assert image.getpalette()[3:6] == [0, 255, 0]
+
+
+def test_replace_with_a_colour_already_there_remaps():
+    image = _blank()
+    image.paste(1, (10, 10, 30, 20))
+    image.paste(1, (50, 60, 55, 70))
+    length = len(image.getpalette())
+    box, before = PadImage.replaceColour(image, "black", "red")
+    assert box == (10, 10, 55, 70)
+    assert before.histogram()[1] == 250  # the black, as it was
+    assert len(image.getpalette()) == length
+    assert 1 not in [colour for count, colour in image.getcolors()]
+    assert image.getpixel((12, 12)) == 2 and image.getpixel((52, 62)) == 2
+
+
+def test_replace_nothing():
+    image = _blank()
+    assert PadImage.replaceColour(image, "#123456", "red") == (None, None)
+    assert PadImage.replaceColour(image, "white", "#ffffff") == (None, None)
+    # in the palette but on no pixels
+    assert PadImage.replaceColour(image, "black", "red") == (None, None)
+
+
+def _speckled():
+    # white with a black square, a few nearly black specks and a red band
+    image = Image.new("RGB", (100, 100), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((10, 10, 39, 39), fill="black")
+    draw.rectangle((0, 80, 99, 99), fill=(230, 0, 0))
+    for x in range(50, 60):
+        image.putpixel((x, 50), (20, 20, 20))  # 0.1% of the picture
+    return image
+
+
+def test_rare_colour_merges_in_to_a_near_common_one():
+    image, counts = PadImage.reduceColours(_speckled())
+    merged, mergedCounts = PadImage.mergeColours(image, counts, 20)
+    rgb = merged.convert("RGB")
+    assert rgb.getpixel((55, 50)) == (0, 0, 0)  # now black
+    assert rgb.getpixel((50, 90)) == (230, 0, 0)  # common, so kept
+    assert sorted(colour for count, colour in rgb.getcolors()) == [
+        (0, 0, 0), (230, 0, 0), (255, 255, 255)]
+    assert sum(mergedCounts) == 100 * 100
+    assert mergedCounts == merged.histogram()[:len(mergedCounts)]
+    kept, keptCounts = PadImage.mergeColours(image, counts, 0)
+    assert kept is image and keptCounts == counts
+
+
+def test_load_merges_as_the_pad_does(tmp_path):
+    filename = str(tmp_path / "speckled.png")
+    _speckled().save(filename)
+    loaded = PadImage.loadImage(filename).convert("RGB")
+    assert loaded.getpixel((55, 50)) == (0, 0, 0)
+    kept = PadImage.loadImage(filename, distance=0).convert("RGB")
+    assert kept.getpixel((55, 50)) == (20, 20, 20)
@@ -0,0 +1,60 @@
+from PIL import Image, ImageDraw
+
+import PadImage
+from PadImage import analyseImage, mergeColours, applyOperation
+from PadJournal import PadJournal
+
+
+def _picture(tmp_path, monkeypatch):
+    # an outline saved as a file, loaded as the pad loads it
+    monkeypatch.setattr(PadImage, "cacheDir", str(tmp_path / "cache"))
+    image = Image.new("RGB", (120, 90), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((10, 10, 50, 50), outline="black", width=2)
+    draw.ellipse((60, 20, 110, 80), outline="black", width=2)
+    filename = str(tmp_path / "outline.png")
+    image.save(filename)
+    settings = {"maxPixels": 0, "distance": 0}
+    image, counts = analyseImage(filename, 0)
+    image, counts = mergeColours(image, counts, 0)
+    return filename, image, settings
+
+
+def _same(a, b):
+    return a.tobytes() == b.tobytes() and a.getpalette() == b.getpalette()
+
+
+def test_replay_after_compaction(tmp_path, monkeypatch):
+    filename, image, settings = _picture(tmp_path, monkeypatch)
+    journal = PadJournal(filename)
+    journal.start(settings)
+    for operation in (("fill", 30, 30, "#ff0000", 0),
+                      ("fix", 85, 50, "#00ff00")):
+        image = applyOperation(image, operation)
+        journal.record(operation)
+    journal.compact(image.copy(), settings)
+    assert journal.count == 0 and journal.exists()
+    image = applyOperation(image, ("fill", 1, 1, "#0000ff", 0))
+    journal.record(("fill", 1, 1, "#0000ff", 0))
+    image.paste(0, (20, 20, 40, 40))  # as an undo leaves it
+    journal.restored(image, (20, 20, 40, 40))
+    palette = image.getpalette()
+    image.putpalette(palette[3:6] + palette[:3] + palette[6:])
+    journal.recoloured(image.getpalette())  # as a palette only undo
+    journal.close()
+    replayed, header = PadJournal(filename).replay()
+    assert header["checkpoint"] and not header["saved"]
+    assert _same(replayed, image)
+
+
+def test_saved_checkpoint_needs_no_replay(tmp_path, monkeypatch):
+    filename, image, settings = _picture(tmp_path, monkeypatch)
+    journal = PadJournal(filename)
+    journal.start(settings)
+    journal.record(("fill", 30, 30, "#ff0000", 0))
+    journal.compact(applyOperation(image, ("fill", 30, 30, "#ff0000", 0)),
+                    settings, saved=True)
+    assert not journal.exists()
+    journal.record(("fill", 1, 1, "#0000ff", 0))
+    assert journal.exists()
+    journal.close()
@@ -0,0 +1,61 @@
+import json
+
+from PadStats import PadStats
+
+
+def test_timed_and_summary():
+    stats = PadStats()
+    with stats.timed("fill"):
+        pass
+    for seconds in (0.3, 0.1, 0.2):
+        stats.add("load", seconds)
+    summary = stats.summary()
+    assert list(summary) == ["fill", "load"]
+    assert summary["fill"]["count"] == 1
+    assert summary["load"] == {"count": 3, "p50": 0.2, "p95": 0.3, "max": 0.3}
+
+
+def test_only_recent_times_kept():
+    stats = PadStats()
+    stats.recent = 10
+    for seconds in range(100):
+        stats.add("fill", seconds)
+    summary = stats.summary()["fill"]
+    assert summary["count"] == 100
+    assert summary["p50"] == 95 and summary["max"] == 99
+
+
+def test_timed_even_when_it_fails():
+    stats = PadStats()
+    try:
+        with stats.timed("fill"):
+            raise ValueError
+    except ValueError:
+        pass
+    assert stats.summary()["fill"]["count"] == 1
+
+
+def test_report_and_clear():
+    stats = PadStats()
+    assert "nothing timed yet" in stats.report()
+    stats.add("adjust", 0.5)
+    assert stats.report().splitlines()[1].split()[0:2] == ["adjust", "1"]
+    stats.clear()
+    assert stats.summary() == {}
+
+
+def test_profile_and_export(tmp_path):
+    stats = PadStats()
+    stats.startProfile()
+    assert stats.profiling()
+    sorted(range(1000))
+    text = stats.stopProfile()
+    assert not stats.profiling() and "function calls" in text
+    stats.add("fill", 0.25)
+    filename = str(tmp_path / "stats.json")
+    stats.export(filename)
+    with open(filename) as file:
+        exported = json.load(file)
+    assert exported["recent"] == {"fill": [0.25]}
+    assert exported["summary"]["fill"]["count"] == 1
+    assert exported["profile"] == text
@@ -0,0 +1,88 @@
+import time
+
+from PIL import Image, ImageChops, ImageDraw
+
+from PadView import PadView
+from ZoomCache import ZoomCache
+
+
+class _Bar(dict):
+    def set(self, first, last):
+        return
+
+
+class _Canvas(dict):
+    # just enough of a canvas to map coordinates without a display
+    xview = yview = None
+
+    def config(self, **options):
+        return
+
+
+def _view(rotated, zoom):
+    image = Image.new("P", (300, 200), 0)
+    image.putpalette([255, 255, 255, 0, 0, 0, 255, 0, 0, 0, 0, 255])
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((10, 20, 60, 90), fill=1)
+    draw.ellipse((150, 40, 280, 190), fill=2)
+    draw.line((0, 199, 299, 0), fill=3, width=3)
+    view = PadView(_Canvas(), _Bar(), _Bar(), ZoomCache())
+    view.update = lambda: None  # no tiles wanted, just the mappings
+    view.rotated = rotated
+    view.setImage(image, zoom)
+    return view, image
+
+
+def _shown(view, image):
+    # the whole picture as the view shows it
+    shown = image.resize(view.zoomedSize, resample=Image.NEAREST)
+    return shown.transpose(Image.ROTATE_270) if view.rotated else shown
+
+
+def test_rotated_size():
+    view, image = _view(True, 0.5)
+    assert (view.width, view.height) == (100, 150)
+    view, image = _view(False, 0.5)
+    assert (view.width, view.height) == (150, 100)
+
+
+def test_boxes_round_trip():
+    for rotated in (False, True):
+        view, image = _view(rotated, 1.5)
+        for box in ((0, 0, 10, 20), (17, 3, 120, 99), (0, 0, view.width, 5)):
+            assert view._shownBox(view._zoomedBox(box)) == box
+            assert view._zoomedBox(view._shownBox(box)) == box
+
+
+def test_tiles_show_the_picture():
+    for rotated in (False, True):
+        for zoom in (1, 0.37, 2.5):
+            view, image = _view(rotated, zoom)
+            while view.cache.level(zoom) is None:  # cut from the zoomed copy
+                time.sleep(0.005)
+            shown = _shown(view, image)
+            assert shown.size == (view.width, view.height)
+            for box in ((0, 0, 64, 64), (30, 50, 90, 80),
+                        (view.width - 40, view.height - 30,
+                         view.width, view.height)):
+                tile = view._tile(box)
+                difference = ImageChops.difference(tile.convert("RGB"),
+                                                   shown.crop(box).convert("RGB"))
+                assert difference.getbbox() is None, (rotated, zoom, box)
+
+
+def test_points_and_boxes_agree():
+    for rotated in (False, True):
+        for zoom in (1, 2, 0.37, 2.5):
+            view, image = _view(rotated, zoom)
+            shown = _shown(view, image)
+            for x, y in ((0, 0), (view.width - 1, view.height - 1),
+                         (view.width // 3, view.height // 2)):
+                px, py = view.imagePoint(x, y)
+                if zoom in (1, 2):  # otherwise the pixel can be a neighbour
+                    assert shown.getpixel((x, y)) == image.getpixel((px, py))
+                left, top, right, bottom = view.displayBox((px, py,
+                                                            px + 1, py + 1))
+                assert left <= x < right and top <= y < bottom
+            assert view.imageBox((0, 0, view.width, view.height)) \
+                == (0, 0) + image.size
@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+from PadWorker import Cancelled, PadWorker
+
+
+class _Widget:
+    # just enough of a widget for after(), run by hand
+    def __init__(self):
+        self.waiting = []
+
+    def after(self, ms, callback):
+        self.waiting.append(callback)
+
+
+def _run(widget, timeout=5):
+    # call what is waiting until nothing more is
+    end = time.monotonic() + timeout
+    while widget.waiting:
+        assert time.monotonic() < end, "timed out"
+        callback = widget.waiting.pop(0)
+        callback()
+        time.sleep(0.001)
+
+
+def test_done_on_the_calling_thread():
+    widget, seen = _Widget(), []
+    worker = PadWorker(widget, busy=lambda flag: seen.append(("busy", flag)),
+                       idle=lambda: seen.append("idle"))
+    worker.submit(lambda job: 6 * 7, done=lambda result: seen.append(result))
+    assert worker.busy()
+    _run(widget)
+    assert not worker.busy()
+    assert seen == [("busy", True), ("busy", False), 42, "idle"]
+
+
+def test_failed():
+    widget, seen = _Widget(), []
+    worker = PadWorker(widget)
+
+    def work(job):
+        raise ValueError("no")
+
+    worker.submit(work, done=seen.append, failed=seen.append)
+    _run(widget)
+    assert len(seen) == 1 and isinstance(seen[0], ValueError)
+
+
+def test_one_job_at_a_time():
+    widget = _Widget()
+    worker = PadWorker(widget)
+    worker.submit(lambda job: None)
+    with pytest.raises(RuntimeError):
+        worker.submit(lambda job: None)
+    _run(widget)
+    worker.submit(lambda job: None)  # free again
+    _run(widget)
+
+
+def test_cancel():
+    widget, seen = _Widget(), []
+    worker = PadWorker(widget, idle=lambda: seen.append("idle"))
+
+    def work(job):
+        while True:
+            job.check()
+            time.sleep(0.001)
+
+    job = worker.submit(work, done=seen.append, failed=seen.append)
+    worker.cancel()
+    assert job.cancelled()
+    with pytest.raises(Cancelled):
+        job.check()
+    _run(widget)
+    assert seen == ["idle"]  # nobody told of the result
+    assert not worker.busy()
+
+
+def test_progress_reported_in_order_before_done():
+    widget, seen = _Widget(), []
+
+    def work(job):
+        for step in range(3):
+            job.report(step)
+        return "done"
+
+    worker = PadWorker(widget)
+    worker.submit(work, done=seen.append, progress=seen.append)
+    _run(widget)
+    assert seen == [0, 1, 2, "done"]
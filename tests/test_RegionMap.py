@@ -0,0 +1,149 @@
+import random
+import time
+
+import pytest
+from PIL import Image, ImageDraw
+
+from FillEngine import region
+from RegionMap import RegionMap, label, numpy
+
+pytestmark = pytest.mark.skipif(numpy is None, reason="needs numpy")
+
+
+def _picture(seed, size=(90, 70)):
+    rand = random.Random(seed)
+    image = Image.new("P", size, 0)
+    image.putpalette([255, 255, 255, 0, 0, 0, 255, 0, 0, 0, 0, 255])
+    draw = ImageDraw.Draw(image)
+    for _ in range(25):
+        x, y = rand.randrange(size[0]), rand.randrange(size[1])
+        draw.rectangle((x, y, x + rand.randrange(1, 25), y + rand.randrange(1, 25)),
+                       outline=rand.randrange(4), fill=rand.randrange(4))
+    return image
+
+
+def _samePartition(labels, expected):
+    # each area of expected is one label and no label spans two areas
+    pairs = numpy.unique(numpy.stack((labels.ravel(), expected.ravel())), axis=1)
+    assert len(numpy.unique(pairs[0])) == pairs.shape[1]
+    assert len(numpy.unique(pairs[1])) == pairs.shape[1]
+
+
+def _wait(regions):
+    for _ in range(500):
+        if regions.ready():
+            return regions
+        time.sleep(0.01)
+    raise AssertionError("never labelled")
+
+
+def _ready(image):
+    regions = RegionMap()
+    regions.start(image)
+    return _wait(regions)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_label_matches_flood_fill(seed):
+    image = _picture(seed)
+    labels, boxes, colours = label(numpy.asarray(image))
+    rand = random.Random(seed)
+    for _ in range(20):
+        xy = (rand.randrange(image.width), rand.randrange(image.height))
+        box, mask, count = region(image, xy)
+        number = labels[xy[1], xy[0]]
+        assert tuple(boxes[number]) == box
+        assert colours[number] == image.getpixel(xy)
+        inside = labels[box[1]:box[3], box[0]:box[2]] == number
+        assert (inside == (numpy.asarray(mask) == 255)).all()
+        assert (labels == number).sum() == count
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_changed_keeps_the_map_right(seed):
+    image = _picture(seed)
+    regions = _ready(image)
+    rand = random.Random(seed + 100)
+    draw = ImageDraw.Draw(image)
+    for _ in range(15):
+        x, y = rand.randrange(image.width), rand.randrange(image.height)
+        box = (x, y, min(image.width, x + rand.randrange(1, 20)),
+               min(image.height, y + rand.randrange(1, 20)))
+        draw.rectangle((box[0], box[1], box[2] - 1, box[3] - 1),
+                       fill=rand.randrange(4))
+        regions.changed(image, box)
+        _wait(regions)  # if an area might have been cut in two
+        _samePartition(regions.labels, label(numpy.asarray(image))[0])
+        for number in numpy.unique(regions.labels):
+            rows, cols = numpy.nonzero(regions.labels == number)
+            left, top, right, bottom = regions.boxes[number]
+            assert left <= cols.min() and top <= rows.min()
+            assert right > cols.max() and bottom > rows.max()
+            xy = (int(cols[0]), int(rows[0]))
+            assert regions.region(xy)[0] == region(image, xy)[0]  # tight
+
+
+def test_filled_merges_neighbours():
+    image = _picture(7)
+    regions = _ready(image)
+    rand = random.Random(7)
+    for _ in range(15):
+        xy = (rand.randrange(image.width), rand.randrange(image.height))
+        value = rand.randrange(4)
+        box, count = regions.fill(image, xy, value)
+        _samePartition(regions.labels, label(numpy.asarray(image))[0])
+        assert regions.colours[regions.labels[xy[1], xy[0]]] == value
+
+
+def test_region_off_picture():
+    regions = _ready(_picture(1))
+    assert regions.region((-1, 0)) == (None, None, 0)
+
+
+def _sheet():
+    # one long line across a sheet, and a grid of cells
+    image = Image.new("P", (200, 120), 0)
+    image.putpalette([255, 255, 255, 0, 0, 0, 255, 0, 0])
+    draw = ImageDraw.Draw(image)
+    draw.line((0, 100, 199, 100), fill=1, width=2)
+    for x in range(0, 200, 20):
+        draw.line((x, 0, x, 90), fill=1)
+    for y in range(0, 91, 15):
+        draw.line((0, y, 199, y), fill=1)
+    return image
+
+
+def test_small_edit_stays_in_its_box():
+    image = _sheet()
+    regions = _ready(image)
+    before = regions.labels.copy()
+    box = (45, 30, 52, 36)  # thickens a line of the grid in to a cell
+    image.paste(1, box)
+    regions.changed(image, box)
+    assert regions.ready()  # nothing left for the thread
+    outside = numpy.ones(before.shape, dtype=bool)
+    outside[box[1] - 1:box[3] + 1, box[0] - 1:box[2] + 1] = False
+    assert (regions.labels[outside] == before[outside]).all()
+    _samePartition(regions.labels, label(numpy.asarray(image))[0])
+
+
+def test_cut_in_two_is_found():
+    image = _sheet()
+    regions = _ready(image)
+    box = (90, 95, 94, 105)  # through the long line
+    image.paste(0, box)
+    regions.changed(image, box)
+    _wait(regions)
+    _samePartition(regions.labels, label(numpy.asarray(image))[0])
+    assert regions.labels[100, 10] != regions.labels[100, 150]
+
+
+def test_joining_areas():
+    image = _sheet()
+    regions = _ready(image)
+    box = (30, 15, 50, 16)  # a gap in a line between two cells
+    image.paste(0, box)
+    regions.changed(image, box)
+    _wait(regions)
+    _samePartition(regions.labels, label(numpy.asarray(image))[0])
+    assert regions.labels[10, 30] == regions.labels[20, 30]
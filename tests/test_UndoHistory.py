@@ -0,0 +1,107 @@
+import random
+
+from PIL import Image, ImageChops, ImageDraw
+
+from UndoHistory import UndoHistory
+
+
+def _picture():
+    image = Image.new("P", (200, 150), 0)
+    image.putpalette([255, 255, 255, 0, 0, 0] + [0] * 6 * 3)
+    return image
+
+
+def _same(a, b):
+    return (ImageChops.difference(a, b).getbbox() is None
+            and a.getpalette() == b.getpalette())
+
+
+def _edits(history, image, count, seed=1):
+    # random rectangles, each recorded, returning the picture after each
+    rand = random.Random(seed)
+    states = [image.copy()]
+    for _ in range(count):
+        x, y = rand.randrange(image.width), rand.randrange(image.height)
+        box = (x, y, min(image.width, x + rand.randrange(5, 80)),
+               min(image.height, y + rand.randrange(5, 80)))
+        before, palette = image.crop(box), image.getpalette()
+        if rand.random() < 0.2:  # sometimes a new colour too
+            image.putpalette(palette[:6] + [rand.randrange(256)] * 3 + palette[9:])
+        ImageDraw.Draw(image).rectangle((box[0], box[1], box[2] - 1, box[3] - 1),
+                                        fill=rand.randrange(4))
+        history.record(image, box, before, palette)
+        states.append(image.copy())
+    return states
+
+
+def test_undo_and_redo_round_trip():
+    image = _picture()
+    history = UndoHistory()
+    states = _edits(history, image, 20)
+    for state in reversed(states[:-1]):
+        assert history.undo(image) is not None
+        assert _same(image, state)
+    assert history.undo(image) is None
+    for state in states[1:]:
+        assert history.redo(image) is not None
+        assert _same(image, state)
+    assert history.redo(image) is None
+
+
+def test_new_edit_drops_redo():
+    image = _picture()
+    history = UndoHistory()
+    _edits(history, image, 3)
+    history.undo(image)
+    assert history.canRedo()
+    _edits(history, image, 1, seed=2)
+    assert not history.canRedo()
+
+
+def test_palette_only_patch():
+    image = _picture()
+    history = UndoHistory()
+    palette = image.getpalette()
+    image.putpalette([0, 0, 0, 255, 255, 255] + palette[6:])
+    history.record(image, (0, 0) + image.size, None, palette)
+    assert history.used() == 0
+    assert history.nextBox() is None
+    assert history.paletteOnly() and not history.paletteOnly(redo=True)
+    history.undo(image)
+    assert image.getpalette() == palette
+    assert history.paletteOnly(redo=True) and not history.paletteOnly()
+
+
+def test_budget_keeps_the_newest():
+    image = _picture()
+    history = UndoHistory(budget=1, diskBudget=1)
+    states = _edits(history, image, 10)
+    undone = 0
+    while history.undo(image):
+        undone += 1
+    assert 1 <= undone < 10
+    assert _same(image, states[-1 - undone])
+
+
+def test_spill_furthest_first():
+    image = _picture()
+    history = UndoHistory()
+    states = _edits(history, image, 8)
+    for _ in range(5):
+        history.undo(image)
+    patches = history._undo + history._redo  # edits 1-3 then 8 down to 4
+    order = []
+    while history.spill(1):  # one at a time
+        order.extend(patch for patch in patches
+                     if patch.spilled and patch not in order)
+    edits = [1, 2, 3, 8, 7, 6, 5, 4]
+    # furthest from the picture as it is first: 8, 7, then 1 and 6, ...
+    assert ([edits[patches.index(patch)] for patch in order]
+            == [8, 7, 1, 6, 2, 5, 3, 4])
+    while history.redo(image):
+        pass
+    assert _same(image, states[-1])
+    while history.undo(image):
+        pass
+    assert _same(image, states[0])
+    history.clear()
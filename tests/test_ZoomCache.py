@@ -0,0 +1,76 @@
+import time
+
+from PIL import Image, ImageDraw
+
+from ZoomCache import ZoomCache, zoomedSize
+
+
+def _picture():
+    image = Image.new("P", (400, 300), 0)
+    image.putpalette([255, 255, 255, 0, 0, 0, 255, 0, 0])
+    draw = ImageDraw.Draw(image)
+    for x in range(0, 400, 20):
+        draw.line((x, 0, x, 300), fill=1, width=2)
+    return image
+
+
+def _until(test, timeout=5):
+    end = time.monotonic() + timeout
+    while not test():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.005)
+    return
+
+
+def _level(cache, zoom):
+    _until(lambda: cache.level(zoom) is not None)
+    return cache.level(zoom)
+
+
+def _right(cache, image, zoom):
+    # the level is what zooming the picture now gives
+    level = _level(cache, zoom)
+    wanted = image.resize(zoomedSize(image, zoom), resample=Image.NEAREST)
+    return (level.tobytes() == wanted.tobytes()
+            and level.getpalette() == image.getpalette())
+
+
+def test_spilled_level_comes_back_with_edits():
+    image = _picture()
+    cache = ZoomCache()
+    cache.setImage(image)
+    _level(cache, 0.5)
+    assert cache.spill(1) > 0 and cache.used() == 0
+    _until(lambda: 0.5 in cache._spilled)
+    assert cache.onDisk() > 0
+    image.paste(2, (30, 30, 90, 60))
+    cache.changed((30, 30, 90, 60))
+    assert _right(cache, image, 0.5)
+    assert cache.onDisk() == 0
+
+
+def test_level_wanted_while_spilling_is_kept():
+    image = _picture()
+    cache = ZoomCache()
+    cache.setImage(image)
+    level = _level(cache, 0.5)
+    cache.spill(1)
+    image.paste(2, (30, 30, 90, 60))
+    cache.changed((30, 30, 90, 60))
+    # taken back before or after it's written, either way up to date
+    again = cache.level(0.5)
+    assert again is None or again is level
+    assert _right(cache, image, 0.5)
+    time.sleep(0.05)  # let the writer finish
+    assert _right(cache, image, 0.5)
+
+
+def test_new_picture_forgets_spilled_levels():
+    image = _picture()
+    cache = ZoomCache()
+    cache.setImage(image)
+    _level(cache, 2)
+    cache.spill(1)
+    cache.setImage(_picture())
+    time.sleep(0.05)
+    assert not cache._spilled and not cache._writing and cache.onDisk() == 0